@@ -1,97 +1,345 @@
 import sys, os, pygame
 from pygame.locals import *
-from pygame.compat import geterror
 from EaselLib import *
 import traceback
-def main(G):
-    # Initialize the game engine
-    pygame.init()
+import threading
+from time import perf_counter
 
-    # Initialize the frameRate
-    FR=20
-    if "frameRate" in dir(G):
-        FR = G.frameRate()
+# do nothing; stands in for the hooks a game does not define
+def noHook(*args):
+    return None
+
+class GameAdapter:
+    '''
+    A game adapter is written GameAdapter(G) where G is a game module. It looks up G's hooks once, when it is made,
+    so that the main loop does not search G every frame.
+    Each hook (init, display, update, sounds, preload) is G's function of that name, or noHook if G does not define
+    it, and hasDisplay and hasPreload are true iff G defines display and preload. Each setting (frameRate, updateRate, maxUpdates, windowDimensions,
+    dirtyRendering, eventDriven, idleTimeout) is the value returned by G's function of that name, or its default.
+    input is the one UserInput the main loop fills in each frame. If G defines setInput, it is handed input once,
+    here, and reads it from then on; otherwise sendInput copies the fields of input onto G each frame, as before,
+    with keysDown and oldKeysDown as KeyViews, so that they cost nothing unless G looks through them.
+    '''
+    def __init__(self,G):
+        self.game = G
+        self.init = self.hook("init")
+        self.display = self.hook("display")
+        self.hasDisplay = self.display != noHook
+        self.update = self.hook("update")
+        self.sounds = self.hook("sounds")
+        self.preload = self.hook("preload")
+        self.hasPreload = self.preload != noHook
+        self.frameRate = self.setting("frameRate",20)
+        self.updateRate = self.setting("updateRate",self.frameRate)
+        self.maxUpdates = self.setting("maxUpdates",5)
+        self.windowDimensions = self.setting("windowDimensions",(800,600))
+        self.dirtyRendering = self.setting("dirtyRendering",False)
+        self.eventDriven = self.setting("eventDriven",False)
+        self.idleTimeout = self.setting("idleTimeout",250)
+        self.input = UserInput()
+        self.copyInput = not "setInput" in dir(G)
+        if not self.copyInput:
+            G.setInput(self.input)
+
+    # G's function called name, or noHook
+    def hook(self,name):
+        f = getattr(self.game,name,None)
+        if callable(f):
+            return f
+        return noHook
+
+    # the value returned by G's function called name, or default
+    def setting(self,name,default):
+        f = getattr(self.game,name,None)
+        if callable(f):
+            return f()
+        return default
+
+    # hand this frame's input to G, if it does not read it through setInput
+    def sendInput(self):
+        if self.copyInput:
+            I = self.input
+            G = self.game
+            G.mouseX,G.mouseY,G.mouseDown,G.oldMouseDown = I.mouseX,I.mouseY,I.mouseDown,I.oldMouseDown
+            # keysDown and oldKeysDown are key views, which only build their lists if the game looks through them
+            G.keysDown,G.oldKeysDown,G.keysPressed = KeyView(I.keys),KeyView(I.oldKeys),I.keysPressed
+
+# the startup report for the times t (see main) at which the game was imported, its window opened, and its
+# first frame shown, in seconds since startup began
+def startupReport(t):
+    return "startup in %.3f s: import %.3f s, window %.3f s, first frame %.3f s" % (
+        t["frame"], t["import"], t["window"] - t["import"], t["frame"] - t["window"])
+
+# run pygame.init() with the SDL drivers in drivers, a dict from environment variable names to driver names, in
+# place of those set in the environment, which is left as it was so that a later game can open a window
+def initWith(drivers):
+    saved = {}
+    for name in drivers:
+        saved[name] = os.environ.get(name)
+    os.environ.update(drivers)
+    try:
+        pygame.init()
+    finally:
+        for name in saved:
+            if saved[name] == None:
+                del os.environ[name]
+            else:
+                os.environ[name] = saved[name]
+
+# sleep until there is an event or ms milliseconds have passed, looking for events every step milliseconds. The
+# events are left in the queue. pygame.event.wait with a timeout is not used, because SDL polls for it every
+# millisecond or so, which costs more CPU than the frames it saves
+def idleWait(ms,step):
+    step = max(1,step)
+    waited = 0
+    while waited < ms:
+        pygame.event.pump()
+        if pygame.event.peek():
+            return
+        pygame.time.wait(min(step,ms-waited))
+        waited += step
+
+# read this frame's input into the user input I, for a window of dimensions WD. If pending is true, no update has
+# seen the input already in I, which is merged with this frame's instead of replaced, so that a click or key press
+# made between updates is not lost. The return value is true iff the window was closed or escape was pressed
+def readInput(I,WD,pending=False):
+    HALT = False
+    # get the mouse position; mouseX and mouseY are the horizontal and vertical  position of the mouse in the window
+    I.mouseX,I.mouseY = pygame.mouse.get_pos()
+    # make the (0,0) the center of the screen
+    I.mouseX = I.mouseX - WD[0]/2
+    I.mouseY = WD[1]/2 -I.mouseY
+
+    # mouseDown is true iff the left mouse button is down
+    down = pygame.mouse.get_pressed()[0]
+    if pending:
+        # keep oldMouseDown as the last update saw it, and a press no update has seen yet
+        I.mouseDown = down or (I.mouseDown and not I.oldMouseDown)
+        # keep oldKeys as the last update saw them, and add to keysPressed
+        I.replaceKeys(pygame.key.get_pressed())
+    else:
+        # oldMouseDown is False in the first frame, and in each subsequent frame is the previous value of mouseDown from the previous frame. It is set to False initially.
+        I.oldMouseDown = I.mouseDown
+        I.mouseDown = down
+
+        # A key is an integer. Keys are named by global variables which are imported with EaselLib.py, given in the first column of the following table:
+        # take one snapshot of the keyboard; the snapshot of the previous frame becomes oldKeys (and oldKeysDown),
+        # which is empty in the first frame
+        I.setKeys(pygame.key.get_pressed())
+        #keysPressed is a set of the keys that went from up to down
+        I.keysPressed = []
+    # get user input within one frame
+    for event in pygame.event.get(): # User did something
+        if event.type == pygame.QUIT: # If user clicked close
+            HALT=True # Flag that we are done so we exit this loop
+        elif event.type == KEYDOWN:
+            if event.key == pygame.K_ESCAPE:
+                HALT=True
+            else:
+                I.keysPressed.append(chr(event.key))
+    return HALT
+
+def main(G,headless=False,frames=None,capture=None):
+    '''
+    Runs the game G, a game module or a GameAdapter for one, until the window is closed, escape is pressed, or frames frames have run (if frames is not None).
+    Rendering and updating are scheduled separately. Frames are drawn at up to frameRate() per second, while update()
+    runs on a fixed timestep of updateRate() per second (frameRate() if updateRate is not defined): each time round
+    the loop, the input is read and update() runs once for every timestep that has passed, at most maxUpdates()
+    times (5 if not defined), after which any time still owed is dropped so that a slow frame cannot snowball. If
+    updateRate() is 0, update() runs once per frame. Only the first update in a frame sees new clicks and key
+    presses. The input is read every frame, so events never wait on an update; if no update runs in a frame, its
+    clicks and key presses are kept for the next update.
+    If headless is true, G runs without a window: SDL's dummy video and audio drivers are used, each frame is drawn
+    onto an offscreen surface and never presented, and the loop runs as fast as it can instead of at frameRate(),
+    with update() run once per frame, uncapped.
+    If G defines preload(), it is run on a background thread once the first frame is shown (but not when headless), to
+    load the assets that G would otherwise load the first time it uses them.
+    If capture is a directory name, each frame drawn is saved in it as frameN.png, where N is the frame number
+    (from 0, padded to 5 digits). If capture is a list, the frame's raw RGB bytes are appended to it instead.
+    The return value is a dict with the number of frames run and of updates run, the seconds they took, and the
+    frames and updates per second, which are also printed for headless runs. Its startup entry holds the seconds
+    from the start of startup (see startupTime in EaselLib) to when main was called (import), the window was
+    opened (window) and the first frame was shown (frame); these are printed if EASEL_STARTUP=1 is set in the
+    environment.
+    '''
+    startup = {"import":startupTime()}
+
+    # Initialize the game engine, with the dummy drivers if headless
+    if headless:
+        pygame.display.quit()
+        initWith({"SDL_VIDEODRIVER":"dummy","SDL_AUDIODRIVER":"dummy"})
+    else:
+        pygame.init()
+
+    # look up the game's hooks once
+    if not isinstance(G,GameAdapter):
+        G = GameAdapter(G)
+
+    # Initialize the frameRate, the update timestep in seconds (0 to update once per frame), and the most updates
+    # to run in one frame to catch up
+    FR = G.frameRate
+    STEP = 0.0
+    if G.updateRate and not headless:
+        STEP = 1.0/G.updateRate
+    CATCHUP = G.maxUpdates
 
     # If windowDimensions() is not defined, set the window dimensions to  (800,600).
     # otherwise set it to the return value of windowDimensions().
-    WD = (800,600)
-    if "windowDimensions" in dir(G):
-        WD = G.windowDimensions()
+    WD = G.windowDimensions
+
+    # If dirtyRendering() is defined and true, redraw and present only the parts of the screen that changed
+    # each frame. Otherwise redraw the whole screen and flip it.
+    DIRTY = G.dirtyRendering
+
+    # If eventDriven() is defined and true, the loop sleeps until there is input whenever a frame shows the same
+    # images as the one before (i.e. display() returned the very same list), instead of running at frameRate().
+    # It wakes up at least every idleTimeout() milliseconds (250 if idleTimeout() is not defined), so that the
+    # game can still update, e.g. for animations or to change the music.
+    IDLE = G.eventDriven
+    IDLE_MS = G.idleTimeout
+
+    # forget the music of any game played before, which pygame.quit() stopped
+    stopMusic()
 
     #if init() is defined, call it
-    if "init" in dir(G):
-        G.init()
+    G.init()
 
-    # set the screen and clock
+    # set the screen and clock. When headless, the (dummy) window only provides the pixel format and event queue,
+    # and frames are drawn onto an offscreen surface
     Screen = pygame.display.set_mode(WD)    
+    # convert the images loaded before the window existed to its pixel format
+    convertImages()
+    if headless:
+        Screen = pygame.Surface(WD).convert()
+    startup["window"] = startupTime()
+    preloader = None
     clock = pygame.time.Clock()
+    frame = 0
+    updates = 0
+    start = perf_counter()
+    last = start
+    lag = 0.0
 
-    #mouseDown is true iff the left mouse button is down
-    G.mouseDown = False
-    G.keysDown = []
+    # the input handed to the game each frame
+    I = G.input
+    pygame.key.set_repeat (500, 30)
     HALT = False
+    pending = False
+    images = None
+    if isinstance(capture,str):
+        os.makedirs(capture,exist_ok=True)
+    # the screen is new: the first frame must be drawn in full, even when only redrawing what changed
+    forgetLastFrame()
     # the main loop
     while not HALT:
         # if display() is defined,display all the images in the list returned by display()
-        if "display" in dir(G):
+        changed = True
+        if G.hasDisplay:
+            oldImages = images
             images = G.display()
-            drawImages(Screen,images)
-            pygame.display.flip()
+            changed = images is not oldImages
+            if DIRTY:
+                rects = drawDirtyImages(Screen,images)
+                if not headless:
+                    pygame.display.update(rects)
+            else:
+                drawImages(Screen,images)
+                if not headless:
+                    pygame.display.flip()
+            # save the frame if capturing
+            if isinstance(capture,str):
+                pygame.image.save(Screen, os.path.join(capture, "frame%05d.png" % frame))
+            elif capture != None:
+                capture.append(pygame.image.tostring(Screen, "RGB"))
 
-        # This limits the while loop to a max of frameRate times per second.
-        # Leave this out and we will use all CPU we can.
-        clock.tick(FR)
+        # once the first frame is shown, load the game's assets in the background, so that the preload does not
+        # hold up the first frame
+        if frame == 0:
+            startup["frame"] = startupTime()
+            if G.hasPreload and not headless:
+                preloader = threading.Thread(target=G.preload,name="preload",daemon=True)
+                preloader.start()
 
-        # set the input variables 
+        # This limits the while loop to a max of frameRate times per second.
+        # Leave this out and we will use all CPU we can, as headless runs do.
+        if not headless:
+            clock.tick(FR)
 
-        # get the mouse position; mouseX and mouseY are the horizontal and vertical  position of the mouse in the window
-        G.mouseX,G.mouseY = pygame.mouse.get_pos()
-        # make the (0,0) the center of the screen
-        G.mouseX = G.mouseX - WD[0]/2
-        G.mouseY = WD[1]/2 -G.mouseY
+        # In event-driven mode, if nothing changed on screen, sleep until there is input or the timeout passes,
+        # leaving the input for the input handling below
+        if IDLE and not changed and not headless:
+            idleWait(IDLE_MS,1000//FR)
+            # the time spent waiting is not owed to update(): run one update for it
+            last = perf_counter()
+            lag = STEP
 
-        # oldMouseDown is False in the first frame, and in each subsequent frame is the previous value of mouseDown from the previous frame. It is set to False initially.
-        G.oldMouseDown = G.mouseDown
+        # work out how many updates are due: one per timestep since the last frame, up to CATCHUP
+        now = perf_counter()
+        lag += now - last
+        last = now
+        if STEP == 0.0:
+            due = 1
+        elif lag >= CATCHUP*STEP:
+            due = CATCHUP
+            lag = 0.0
+        else:
+            due = int(lag/STEP)
+            lag -= due*STEP
 
-        # oldKeysDown  is a set of the keys that were down in the previous frame. It begins as empty.
-        G.oldKeysDown = G.keysDown
-        # mouseDown is true iff the left mouse button is down
-        G.mouseDown=pygame.mouse.get_pressed()[0]
+        # read the input once per frame, keeping any input the last frame read but no update saw
+        HALT = readInput(I,WD,pending) or HALT
+        pending = True
 
-        # A key is an integer. Keys are named by global variables which are imported with EaselLib.py, given in the first column of the following table:
-        G.keysDown = [i for i in range(0,len(pygame.key.get_pressed())) if pygame.key.get_pressed()[i]]
-        pygame.key.set_repeat (500, 30)
-        #keysPressed is a set of the keys that went from up to down
-        G.keysPressed = []
-        # get user input within one frame
-        for event in pygame.event.get(): # User did something
-            if event.type == pygame.QUIT: # If user clicked close
-                HALT=True # Flag that we are done so we exit this loop
-            elif event.type == KEYDOWN:
-                if event.key == pygame.K_ESCAPE:
-                    HALT=True
-                else:
-                    G.keysPressed.append(chr(event.key))
-
-        # update the game with user input
-        #IN = UserInput([mouseX,mouseY,oldMouseDown,mouseDown,oldKeysDown,keysDown,keysPressed])
-        # if sounds() is defined, play the sounds in the list returned by sounds()
-        if "sounds" in dir(G):
+        # update the game. Extra updates to catch up see the same input, but no new clicks
+        for n in range(due):
+            if n > 0:
+                I.settle()
+            pending = False
+            # update the game with user input
+            G.sendInput()
+            # if sounds() is defined, play the sounds in the list returned by sounds()
             playSounds(G.sounds())
-        if "update" in dir(G):
             G.update()
+            updates += 1
+
+        # count the frame, and stop once frames frames have run
+        frame += 1
+        if frames != None and frame >= frames:
+            HALT = True
+    seconds = perf_counter() - start
+    stats = {"frames":frame, "updates":updates, "seconds":seconds,
+             "fps":frame/seconds if seconds > 0 else 0.0, "ups":updates/seconds if seconds > 0 else 0.0,
+             "startup":startup}
+    if os.environ.get("EASEL_STARTUP") == "1":
+        print(startupReport(startup))
+    if headless:
+        print("%d frames and %d updates in %.2f s: %.1f frames and %.1f updates per second" %
+              (frame, updates, seconds, stats["fps"], stats["ups"]))
+    # let the preload finish before pygame shuts down under it
+    if preloader != None:
+        preloader.join()
     # Be IDLE friendly
+    stopMusic()
     pygame.quit()
+    return stats
 
-def play(game):
+# play the game in the file game.py. headless, frames and capture are passed on to main, e.g.
+# play("maegen", headless=True, frames=500) renders 500 frames of maegen without a window and reports the frame rate
+def play(game,headless=False,frames=None,capture=None):
     # clear imported module cache
     if game in sys.modules:
         del sys.modules[game]
-    # import the game file
+    # import the game file, measuring startup from here
+    startupBegins()
     G = __import__(game)
     # call the game engine to play the game using the functions defined in the game file
     try:
-        main(G)
+        # look up the hooks first, so that a game that cannot be set up is reported like any other error in it
+        G = GameAdapter(G)
+        if not G.hasDisplay and G.update == noHook:
+            print("The game",game,"defines neither display() nor update(), so it has nothing to show or do")
+            return
+        return main(G,headless,frames,capture)
     except:
         # print out the error message if there is an error in the game file
         print(traceback.format_exc())
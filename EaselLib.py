@@ -1,5 +1,10 @@
+from time import perf_counter
+# the time this library started loading, from which a game's startup is measured (see startupTime)
+_startup={"start":perf_counter()}
 import pygame,os
 import sys
+from collections import Counter, OrderedDict
+from collections.abc import Sequence
 
 
 #######################################################################################
@@ -9,16 +14,157 @@ import sys
 # use a global image library to store the images to prevent reloading for performance purpose
 _image_library={}
 
+# use a global library of images read by readImageFile, which loadImageFile converts and moves to the image library
+_read_library={}
+
+# use a global library of scaled images, keyed by (name, size), so that rescaling never reloads the file
+_scaled_library={}
+
+# use a global font library, keyed by size, and a bounded library of rendered text surfaces, keyed by
+# (text, size, color) and dropping the least recently used surface when full, to prevent re-rendering text
+_font_library={}
+_text_library=OrderedDict()
+_text_stats={"hits":0,"misses":0}
+TEXT_LIBRARY_SIZE=256
+
+# use a global record of the last frame drawn by drawDirtyImages, and the surface it was drawn on, to find the
+# regions that changed
+_last_frame={"screen":None,"size":None,"images":None,"keys":None,"rects":None,"pixels":0}
+
 # draw the list of images to the screen
 def drawImages(screen,images):
     WHITE = (255,255,255)
     screen.fill(WHITE)
+    drawImageList(screen,images)
+    _last_frame["pixels"] = screen.get_width()*screen.get_height()
+
+# use a global flag to choose how images are checked before they are drawn. Every image checks the parts
+# of isDrawable that do not depend on the screen once, when it is made, and keeps the result in its
+# valid attribute; images are not meant to be changed after they are made. Normally drawImage trusts
+# that check. With strict drawing on (setStrictDrawing(True), or EASEL_STRICT=1 in the environment),
+# drawImage calls isDrawable on every image every frame, which also catches images that are off the
+# screen or were changed after they were made.
+_strict_drawing = os.environ.get("EASEL_STRICT") == "1"
+
+def setStrictDrawing(b):
+    global _strict_drawing
+    _strict_drawing = b
+
+# true iff the image x can be drawn on the screen: its valid attribute, unless strict drawing is on or x has no
+# valid attribute (as an image class written for an older EaselLib may not), in which case x.isDrawable(screen)
+def canDraw(screen,x):
+    valid = getattr(x,"valid",None)
+    if _strict_drawing or valid == None:
+        return x.isDrawable(screen)
+    return valid
+
+# draw one image to the screen, or quit if it cannot be drawn
+def drawImage(screen,x):
+    if canDraw(screen,x):
+        x.draw(screen)
+    else:
+        print("Error drawing",x)
+        pygame.quit()
+
+# draw the list of images to the screen in order, without clearing it first. Each run of consecutive file
+# images is drawn with one Surface.blits call, with the positions converted to screen coordinates here.
+def drawImageList(screen,images):
+    W,H=screen.get_size()
+    batch=[]
     for x in images:
-        if x.isDrawable(screen):
-            x.draw(screen)
+        if x.category == "fileImg" and canDraw(screen,x):
+            p = x.pos
+            batch.append((x.image,(p[0]+W/2,H/2-p[1])))
         else:
-            print("Error drawing",x)
-            pygame.quit()
+            if batch:
+                screen.blits(batch,False)
+                batch=[]
+            drawImage(screen,x)
+    if batch:
+        screen.blits(batch,False)
+
+# draw the list of images to the screen, repainting only what changed since the last call
+def drawDirtyImages(screen,images):
+    '''surface * list(image) -> list(Rect)
+    drawDirtyImages(screen,images) leaves the screen as drawImages(screen,images) would, and returns
+    the list of rectangles it repainted, to be passed to pygame.display.update.
+    It compares images against the images of the previous call, and repaints only the regions covered
+    by images that were added or removed, drawing in each region the images that overlap it.
+    The whole screen is repainted on the first call, when the screen is another surface or changes size (and
+    after forgetLastFrame), when images only
+    changed order, or when the changed regions cover the screen. If nothing changed, no rectangles are returned.
+    If images is the very list passed last time (as from a game that memoizes display()), nothing is compared
+    or drawn, so lists must not be changed after they are drawn.
+    '''
+    WHITE = (255,255,255)
+    size = screen.get_size()
+    same = screen is _last_frame["screen"] and size == _last_frame["size"]
+    if images is _last_frame["images"] and same:
+        _last_frame["pixels"] = 0
+        return []
+    keys = [x.key() for x in images]
+    current = None
+    if not same or _last_frame["keys"] == None:
+        rects = None
+    elif keys == _last_frame["keys"]:
+        rects = []
+    else:
+        old = Counter(_last_frame["keys"])
+        new = Counter(keys)
+        if old == new:
+            rects = None
+        else:
+            current = dict(zip(keys,[x.bounds(screen) for x in images]))
+            changed = [_last_frame["rects"][k] for k in (old-new)] + [current[k] for k in (new-old)]
+            rects = mergeRects(changed,screen.get_rect())
+            if sum(r.width*r.height for r in rects) >= size[0]*size[1]:
+                rects = None
+    if rects == None:
+        drawImages(screen,images)
+        rects = [screen.get_rect()]
+    else:
+        for r in rects:
+            screen.set_clip(r)
+            screen.fill(WHITE)
+            drawImageList(screen,[x for x in images if r.colliderect(current[x.key()])])
+        screen.set_clip(None)
+    if current == None and rects != []:
+        current = dict(zip(keys,[x.bounds(screen) for x in images]))
+    if current != None:
+        _last_frame["rects"] = current
+    _last_frame["screen"] = screen
+    _last_frame["size"] = size
+    _last_frame["images"] = images
+    _last_frame["keys"] = keys
+    _last_frame["pixels"] = sum(r.width*r.height for r in rects)
+    return rects
+
+# forget the last frame drawn by drawDirtyImages, so that its next call repaints the whole screen. Call this when
+# the screen may have been drawn on by anything else, e.g. at the start of a game
+def forgetLastFrame():
+    _last_frame.update(screen=None,size=None,images=None,keys=None,rects=None)
+
+# merge overlapping rectangles, clipped to the screen rectangle, into a list of disjoint rectangles
+def mergeRects(rects,screenRect):
+    out = []
+    for r in rects:
+        r = r.clip(screenRect)
+        if r.width > 0 and r.height > 0:
+            i = r.collidelist(out)
+            while i != -1:
+                r = r.union(out.pop(i))
+                i = r.collidelist(out)
+            out.append(r)
+    return out
+
+# the number of pixels drawImages or drawDirtyImages pushed in its last call
+def lastFramePixels():
+    return _last_frame["pixels"]
+
+# the screen rectangle between screen coordinates (x1,y1) and (x2,y2), widened by m pixels on every side
+def screenRect(x1,y1,x2,y2,m):
+    left,top = int(min(x1,x2))-m,int(min(y1,y2))-m
+    return pygame.Rect(left,top,int(max(x1,x2))-left+m+1,int(max(y1,y2))-top+m+1)
 
 # isPoint(point,screen) is true iff point is a point in the screen's dimension
 def isPoint(point,screen):
@@ -34,6 +180,10 @@ def isPoint(point,screen):
             return x >= -W/2 and x<=W/2 and y>=-H/2 and y<=H/2
     return False
 
+# isPair(point) is true iff point is a pair, as a point must be; unlike isPoint it does not need the screen
+def isPair(point):
+    return isinstance(point,tuple) and len(point)==2
+
 # A color is written (R,G,B) where R, G, and B are integers and 0 ≤ R,G,B ≤ 255
 def isColor(color):
     if isinstance(color,tuple):
@@ -56,6 +206,12 @@ class Image:
     # check to see if the image can be drawed in the screen
     def isDrawable(self,screen):
         raise NotImplementedError("Subclass must implement abstract method")
+    # the rectangle of the screen the image can draw to
+    def bounds(self,screen):
+        raise NotImplementedError("Subclass must implement abstract method")
+    # a tuple that is equal for two images iff they draw the same pixels
+    def key(self):
+        raise NotImplementedError("Subclass must implement abstract method")
 
 class seg(Image):
     '''
@@ -66,6 +222,7 @@ class seg(Image):
         self.start = p # the start endpoint of the segment
         self.end = q # the end endpoint of the segment
         self.color = c # the color of the segment
+        self.valid = isPair(p) and isPair(q) and isColor(c)
 
     def draw(self,screen):
         (x1,y1),(x2,y2),color= self.start, self.end,self.color
@@ -77,6 +234,14 @@ class seg(Image):
     def isDrawable(self,screen):
         return isPoint(self.start,screen) and isPoint(self.end,screen) and isColor(self.color)
 
+    def bounds(self,screen):
+        (x1,y1),(x2,y2)= self.start, self.end
+        W,H=screen.get_size()
+        return screenRect(x1+W/2,H/2-y1,x2+W/2,H/2-y2,2)
+
+    def key(self):
+        return (self.category,tuple(self.start),tuple(self.end),tuple(self.color))
+
     def __str__(self):
         return "seg(" + str(self.start) + "," + str(self.end) + ")"
 class circ(Image):
@@ -89,6 +254,7 @@ class circ(Image):
         self.center = p
         self.radius = r
         self.color = c
+        self.valid = isPair(p) and isinstance(r,int) and r>0 and isColor(c)
     def draw(self,screen):
         (x,y),radius,color= self.center, self.radius,self.color
         x=int(x)
@@ -98,6 +264,12 @@ class circ(Image):
         pygame.draw.circle(screen, tuple(color), center, radius,1)
     def isDrawable(self,screen):
         return isPoint(self.center,screen) and isinstance(self.radius,int) and self.radius>0 and isColor(self.color)
+    def bounds(self,screen):
+        (x,y),radius= self.center, self.radius
+        W,H=screen.get_size()
+        return screenRect(int(x)+W//2-radius,H//2-int(y)-radius,int(x)+W//2+radius,H//2-int(y)+radius,1)
+    def key(self):
+        return (self.category,tuple(self.center),self.radius,tuple(self.color))
 
     def __str__(self):
         return "circ(" + str(self.center) + "," + str(self.radius)+")"
@@ -111,6 +283,7 @@ class disc(Image):
         self.center = p
         self.radius = r
         self.color = c
+        self.valid = isPair(p) and isinstance(r,int) and r>0 and isColor(c)
     def draw(self,screen):
         (x,y),radius,color= self.center, self.radius,self.color
         x=int(x)
@@ -120,6 +293,12 @@ class disc(Image):
         pygame.draw.circle(screen, tuple(color), center, radius,0)
     def isDrawable(self,screen):
         return isPoint(self.center,screen) and isinstance(self.radius,int) and self.radius>0 and isColor(self.color)
+    def bounds(self,screen):
+        (x,y),radius= self.center, self.radius
+        W,H=screen.get_size()
+        return screenRect(int(x)+W//2-radius,H//2-int(y)-radius,int(x)+W//2+radius,H//2-int(y)+radius,1)
+    def key(self):
+        return (self.category,tuple(self.center),self.radius,tuple(self.color))
     def __str__(self):
         return "disc("+str((self.center)) +","+ str(self.radius) + ")"
 class txt(Image):
@@ -133,6 +312,7 @@ class txt(Image):
         self.center = p
         self.height = n
         self.color = c
+        self.valid = isinstance(s,str) and isPair(p) and isColor(c) and isinstance(n,int) and n in range(4,101)
     def draw(self,screen):
         string,center,fontScreenSize,color = self.text,self.center,self.height,self.color
         [x,y]= center
@@ -141,13 +321,20 @@ class txt(Image):
         x=W/2+x
         T = string
         if pygame.font:
-            font = pygame.font.Font(None, fontScreenSize)
-            text = font.render(T, 1, color)
+            text = renderText(T, fontScreenSize, color)
             textpos = text.get_rect(centerx=int(x),centery=int(y))
             #screen.blit(text, [x,y])
             screen.blit(text, textpos)
     def isDrawable(self,screen):
         return isinstance(self.text,str) and isPoint(self.center,screen) and isColor(self.color) and isinstance(self.height,int) and self.height in range(4,101)
+    def bounds(self,screen):
+        [x,y]= self.center
+        W,H=screen.get_size()
+        w,h = renderText(self.text, self.height, self.color).get_size() if pygame.font else (0,0)
+        x,y = int(W/2+x),int(H/2-y)
+        return screenRect(x-w/2,y-h/2,x+w/2,y+h/2,1)
+    def key(self):
+        return (self.category,self.text,tuple(self.center),self.height,tuple(self.color))
 
 class ftri(Image):
     '''
@@ -160,6 +347,8 @@ class ftri(Image):
         self.v2 = q
         self.v3 = r
         self.color = c
+        self.valid = isPair(p) and isPair(q) and isPair(r) and isColor(c) and \
+            (q[0]-p[0])*(r[1]-p[1]) != (q[1]-p[1])*(r[0]-p[0])
     def draw(self,screen):
         p,q,r,color= self.v1,self.v2,self.v3,self.color
         W,H=screen.get_size()
@@ -171,6 +360,15 @@ class ftri(Image):
     def isDrawable(self,screen):
         return self.isNonCollinear(self.v1,self.v2,self.v3,screen) and isColor(self.color)
 
+    def bounds(self,screen):
+        W,H=screen.get_size()
+        xs=[p[0]+W/2 for p in (self.v1,self.v2,self.v3)]
+        ys=[H/2-p[1] for p in (self.v1,self.v2,self.v3)]
+        return screenRect(min(xs),min(ys),max(xs),max(ys),1)
+
+    def key(self):
+        return (self.category,tuple(self.v1),tuple(self.v2),tuple(self.v3),tuple(self.color))
+
     def isNonCollinear(self,p,q,r,screen):
         if isPoint(p,screen) and isPoint(q,screen) and isPoint(r,screen):
             return not self.slope(p,q,screen)==self.slope(q,r,screen)
@@ -186,6 +384,42 @@ class ftri(Image):
     def __str__(self):
         return "ftri(" + str(self.v1) + "," + str(self.v2)+ "," + str(self.v3)+")"
 
+class rect(Image):
+    '''
+    A filled rectangle is written rect(p, w, h, C) where p is a point, w and h are positive numbers, and C is a color.
+    The filled rectangle rect(p, w, h, C) represents the rectangle of color C with its top-left corner at p, w wide and h high.
+    It covers the same pixels as the two filled triangles that split it along a diagonal, but is drawn as one polygon,
+    which measured faster than both the triangle pair and Surface.fill.
+    '''
+    def __init__(self,p,w,h,c):
+        self.category = "rect"
+        self.topLeft = p
+        self.width = w
+        self.height = h
+        self.color = c
+        self.valid = isPair(p) and isinstance(w,(int,float)) and w>0 and isinstance(h,(int,float)) and h>0 and isColor(c)
+
+    def draw(self,screen):
+        (x,y),w,h=self.topLeft,self.width,self.height
+        W,H=screen.get_size()
+        x,y=x+W/2,H/2-y
+        pygame.draw.polygon(screen, tuple(self.color), [(x,y),(x+w,y),(x+w,y+h),(x,y+h)], 0)
+
+    def isDrawable(self,screen):
+        (x,y)=self.topLeft
+        return isPoint(self.topLeft,screen) and isPoint((x+self.width,y-self.height),screen) and self.valid
+
+    def bounds(self,screen):
+        (x,y)=self.topLeft
+        W,H=screen.get_size()
+        return screenRect(x+W/2,H/2-y,x+self.width+W/2,H/2-y+self.height,0)
+
+    def key(self):
+        return (self.category,tuple(self.topLeft),self.width,self.height,tuple(self.color))
+
+    def __str__(self):
+        return "rect(" + str(self.topLeft) + "," + str(self.width) + "," + str(self.height) + ")"
+
 class fileImg(Image):
     '''
     A file image is written fileImg (x,m,n) where x is an image loaded from a file and m and n are integers.
@@ -195,6 +429,7 @@ class fileImg(Image):
         self.category = "fileImg"
         self.image = img
         self.pos = pos
+        self.valid = isinstance(img,pygame.Surface) and isPair(pos)
 
     def draw(self,screen):
         image,p = self.image,self.pos
@@ -205,9 +440,57 @@ class fileImg(Image):
     def isDrawable(self,screen):
         return isinstance(self.image,pygame.Surface) and isPoint(self.pos,screen)
 
+    def bounds(self,screen):
+        p = self.pos
+        W,H=screen.get_size()
+        w,h=self.image.get_size()
+        return screenRect(p[0]+W/2,H/2-p[1],p[0]+W/2+w,H/2-p[1]+h,1)
+
+    def key(self):
+        return (self.category,self.image,tuple(self.pos))
+
     def __str__(self):
         return "fileImg(" + self.image +","+ str(self.pos) + ")"
 
+# forget every font loaded. pygame.quit() frees the fonts it loaded, and using one afterwards crashes, so this runs
+# whenever pygame quits (e.g. at the end of Easel.main), registering itself again for the next time. Rendered text
+# surfaces do not depend on the fonts and are kept
+def forgetFonts():
+    _font_library.clear()
+    pygame.register_quit(forgetFonts)
+
+pygame.register_quit(forgetFonts)
+
+# load the default font at size n, once for each size
+def loadFont(n):
+    global _font_library
+    font = _font_library.get(n)
+    if font == None:
+        font = pygame.font.Font(None, n)
+        _font_library[n] = font
+    return font
+
+# render the string s with the default font at size n and color c, reusing the surface if it was rendered recently
+def renderText(s,n,c):
+    global _text_library
+    key = (s,n,tuple(c))
+    text = _text_library.get(key)
+    if text == None:
+        _text_stats["misses"] += 1
+        text = loadFont(n).render(s, 1, c)
+        _text_library[key] = text
+        if len(_text_library) > TEXT_LIBRARY_SIZE:
+            _text_library.popitem(last=False)
+    else:
+        _text_stats["hits"] += 1
+        _text_library.move_to_end(key)
+    return text
+
+# the statistics of the text cache: hits and misses of renderText, and the numbers of fonts and text surfaces held
+def textCacheStats():
+    return {"hits":_text_stats["hits"], "misses":_text_stats["misses"],
+            "fonts":len(_font_library), "texts":len(_text_library)}
+
 # load the image from the file under the sub-directory named 'media',
 def loadImageFile(name):
     global _image_library
@@ -215,25 +498,82 @@ def loadImageFile(name):
     if image == None:
         fullname = os.path.join('media', name)
         try:
-            image = pygame.image.load(fullname)
+            image = _read_library.pop(name,None)
+            if image == None:
+                image = pygame.image.load(fullname)
+            image = displayFormat(image,True)
             _image_library[name] = image
         except:
             print("Cannot load images: ",fullname)
             pygame.quit()
     return image
 
+# read the image from the file under the sub-directory named 'media' into a library of images that loadImageFile
+# has yet to convert, unless it is loaded already. Nothing that is drawn is touched, so this can run on a
+# background thread while the main thread draws; the conversion and scaling are left to the main thread
+def readImageFile(name):
+    if name in _image_library or name in _read_library:
+        return
+    fullname = os.path.join('media', name)
+    try:
+        _read_library[name] = pygame.image.load(fullname)
+    except:
+        print("Cannot load images: ",fullname)
+
+# load the image from the file under the sub-directory named 'media', scaled to size, a pair (w,h) of integers.
+# Each file is loaded once, and scaled once for each size
+def loadScaledImage(name,size):
+    global _scaled_library
+    image = _scaled_library.get((name,size))
+    if image == None:
+        image = pygame.transform.scale(loadImageFile(name), size)
+        _scaled_library[(name,size)] = image
+    return image
+
+# the image converted to the pixel format of the window, with per-pixel alpha if alpha is true, so that it
+# blits without a conversion each time. Before the window exists, the image itself
+def displayFormat(image,alpha):
+    if pygame.display.get_surface() == None:
+        return image
+    if alpha:
+        return image.convert_alpha()
+    return image.convert()
+
+# convert every image loaded so far to the pixel format of the window. Call this once the window exists
+def convertImages():
+    for library in [_image_library,_scaled_library]:
+        for name in library:
+            library[name] = displayFormat(library[name],True)
+
 #######################################################################################
 # Begin Define functions and class for sound playing
 #######################################################################################
 import pygame.mixer, pygame.time
+import io, queue, threading
 time = pygame.time
 mixer = pygame.mixer
-mixer.init(frequency=11025, size=-16, channels=2,buffer=512)
+# the mixer settings are only recorded here; the mixer opens with them when pygame.init() runs, or when the first
+# sound is decoded, so that importing a game doesn't open the audio device
+mixer.pre_init(frequency=11025, size=-16, channels=2,buffer=512)
 #mixer.init(11025)
 main_dir = os.path.split(os.path.abspath(__file__))[0]
 
-# use a global sound library to store the sound
+# use a global sound library to store the sound, or None for a file that could not be loaded
 _sound_library={}
+_sound_lock=threading.Lock()
+_mixer_state={"failed":False}
+
+# open the mixer, if it isn't open yet. The return value is true iff the mixer is open
+def initMixer():
+    if not mixer.get_init() and not _mixer_state["failed"]:
+        try:
+            mixer.init()
+            stopMusic()
+        except pygame.error:
+            print("Cannot open the mixer")
+            _mixer_state["failed"] = True
+    return mixer.get_init() != None
+
 def playSounds(S):
     if S==None:
         return
@@ -241,25 +581,128 @@ def playSounds(S):
         if not sound==None:
             channel = sound.play(loops=0, maxtime=0, fade_ms=0)
 
-# check to see the sound is already loaded before loading
+# check to see the sound is already loaded before loading. The return value is None if it cannot be loaded.
+# Sounds may be loaded from a background thread: the library is locked while a sound is decoded, so that a sound
+# wanted on two threads at once is decoded once
 def loadSoundFile(name):
     global _sound_library
-    sound = _sound_library.get(name)
-    if sound ==None:
+    if not name in _sound_library:
+        if not initMixer():
+            return None
+        with _sound_lock:
+            if not name in _sound_library:
+                file_path = os.path.join(main_dir,'media',name)
+                try:
+                    _sound_library[name] = mixer.Sound(file_path)
+                except:
+                    print("Cannot load sound: ", file_path)
+                    _sound_library[name] = None
+    return _sound_library[name]
+
+class soundFile:
+    '''
+    A sound file is written soundFile(name) where name is the name of a file under the sub-directory named 'media'.
+    It is a handle for the sound: the file is only decoded (with loadSoundFile) the first time the sound is loaded
+    or played, so that a game can name its sounds when it is imported without opening the mixer.
+    '''
+    def __init__(self,name):
+        self.name = name
+
+    # the decoded sound, or None if it cannot be loaded
+    def load(self):
+        return loadSoundFile(self.name)
+
+    # play the sound, as a pygame Sound does; nothing happens if it cannot be loaded
+    def play(self,loops=0,maxtime=0,fade_ms=0):
+        sound = self.load()
+        if sound == None:
+            return None
+        return sound.play(loops,maxtime,fade_ms)
+
+    def __str__(self):
+        return "soundFile(" + self.name + ")"
+
+# use a global music library of track files read into memory, keyed by name, and a single worker thread that
+# owns pygame.mixer.music, so that neither reading a track nor switching to it ever blocks the game loop
+_music_library={}
+_music_state={"requested":None,"playing":None,"stream":None,"worker":None}
+_music_queue=queue.Queue()
+
+# start the music worker the first time a track is requested or preloaded
+def musicWorker():
+    if _music_state["worker"]==None:
+        worker = threading.Thread(target=runMusicWorker,name="music",daemon=True)
+        _music_state["worker"] = worker
+        worker.start()
+    return _music_state["worker"]
+
+# serve requests from the music queue until a stop request; a play request that a newer one has overtaken is dropped
+def runMusicWorker():
+    while True:
+        (request,name) = _music_queue.get()
+        if request=="stop":
+            return
+        if request=="preload":
+            readMusicFile(name)
+        elif name==_music_state["requested"] and name!=_music_state["playing"]:
+            startMusic(name)
+
+# read a track into the music library unless it is already there; None if the file cannot be read
+def readMusicFile(name):
+    if name not in _music_library:
+        file_path = os.path.join(main_dir,'media',name)
         try:
-            file_path = os.path.join(main_dir,'media',name)
-            sound = mixer.Sound(file_path)
-            _sound_library[name] = sound
-        except:
-            print("Cannot load sound: ", file_path)
-            pygame.quit()
-    return sound
+            with open(file_path,'rb') as f:
+                _music_library[name] = f.read()
+        except (IOError,OSError):
+            print("Cannot load music: ", file_path)
+            _music_library[name] = None
+    return _music_library[name]
 
-def playBackGroundMusic(name):
+# stream a track from memory on the music channel, looping forever
+def startMusic(name):
+    data = readMusicFile(name)
+    if data==None:
+        return
+    stream = io.BytesIO(data)
+    try:
+        mixer.music.load(stream,os.path.splitext(name)[1][1:])
+        mixer.music.play(-1)
+    except pygame.error:
+        print("Cannot play music: ", name)
+        return
+    _music_state["stream"] = stream
+    _music_state["playing"] = name
+
+# read the named tracks in the background, so that a later playBackGroundMusic starts them from memory
+def preloadMusic(names):
     if pygame.mixer:
-        music = os.path.join(main_dir, 'media', name)
-        pygame.mixer.music.load(music)
-        pygame.mixer.music.play(-1)
+        musicWorker()
+        for name in names:
+            _music_queue.put(("preload",name))
+
+# switch the background music to the named track without waiting for it; nothing happens if that track was
+# the last one requested, so a phase that shares its music with the previous phase keeps playing it
+def playBackGroundMusic(name):
+    if pygame.mixer and name!=_music_state["requested"] and initMixer():
+        _music_state["requested"] = name
+        musicWorker()
+        _music_queue.put(("play",name))
+
+# the name of the track playing, or None
+def musicPlaying():
+    return _music_state["playing"]
+
+# stop the music and the music worker, and forget which track was requested, so that the next request plays even
+# if it names the same track. Call this before the mixer is closed or after it is opened again
+def stopMusic():
+    worker = _music_state["worker"]
+    if worker!=None:
+        _music_queue.put(("stop",None))
+        worker.join()
+    if mixer.get_init():
+        mixer.music.stop()
+    _music_state.update(requested=None,playing=None,stream=None,worker=None)
 
 def playSound(s):
     if s==None:
@@ -278,6 +721,129 @@ def playSound(s):
 # CLAP = loadSoundFile("clap.wav")
 # CLICK = loadSoundFile("click.wav")
 
+# the user input of one frame
+class UserInput:
+    '''
+    A user input holds the input of one frame: mouseX and mouseY, the position of the mouse with (0,0) in the center
+    of the screen; mouseDown and oldMouseDown, whether the left mouse button is down this frame and was down the
+    frame before; keys and oldKeys, the snapshots from pygame.key.get_pressed() of this frame and the frame before
+    (None before the first frame); and keysPressed, the characters of the keys that went down this frame.
+    Easel.main fills in one user input in place each frame, taking one key snapshot per frame with setKeys (or
+    replaceKeys, if no update saw the frame before).
+    isDown and wasPressed answer questions about one key in constant time. keysDown and oldKeysDown, the lists of
+    the keys down this frame and the frame before, are only built if they are asked for.
+    '''
+    __slots__ = ["mouseX","mouseY","mouseDown","oldMouseDown","keys","oldKeys","keysPressed","_keysDown","_oldKeysDown"]
+    def __init__(self):
+        self.mouseX = 0
+        self.mouseY = 0
+        self.mouseDown = False
+        self.oldMouseDown = False
+        self.keys = None
+        self.oldKeys = None
+        self.keysPressed = []
+        self._keysDown = []
+        self._oldKeysDown = []
+
+    # make keys the snapshot of this frame, and the old value of keys that of the frame before
+    def setKeys(self,keys):
+        self.oldKeys = self.keys
+        self.keys = keys
+        self._oldKeysDown = self._keysDown
+        self._keysDown = None
+
+    # make keys the snapshot of this frame, keeping oldKeys, for input that is read again before any update sees it
+    def replaceKeys(self,keys):
+        self.keys = keys
+        self._keysDown = None
+
+    # make this input look like the input of a frame in which nothing new happened: the mouse button and keys
+    # stay as they are, but none went down, so that a second update in the same frame sees no new clicks
+    def settle(self):
+        self.oldMouseDown = self.mouseDown
+        self.setKeys(self.keys)
+        self.keysPressed = []
+
+    # true iff key k is down this frame
+    def isDown(self,k):
+        return self.keys != None and self.keys[k]
+
+    # true iff key k is down this frame but was not down the frame before
+    def wasPressed(self,k):
+        return self.isDown(k) and not (self.oldKeys != None and self.oldKeys[k])
+
+    # the list of the keys down this frame, built from keys the first time it is asked for
+    @property
+    def keysDown(self):
+        if self._keysDown == None:
+            self._keysDown = keyList(self.keys)
+        return self._keysDown
+
+    # the list of the keys down the frame before
+    @property
+    def oldKeysDown(self):
+        if self._oldKeysDown == None:
+            self._oldKeysDown = keyList(self.oldKeys)
+        return self._oldKeysDown
+
+# the list of the indices of the keys down in the snapshot keys from pygame.key.get_pressed(), or [] if keys is None
+def keyList(keys):
+    if keys == None:
+        return []
+    return [i for i in range(len(keys)) if keys[i]]
+
+# the keys down in a keyboard snapshot, as a read-only list that is only built if it is looked through
+class KeyView(Sequence):
+    '''
+    A key view is written KeyView(keys) where keys is a snapshot from pygame.key.get_pressed(), or None. It reads as
+    the list keyList(keys): it can be iterated, indexed, measured and compared with a list. "k in v" looks key k
+    up in keys directly; anything else builds the list, once. Easel.main hands key views to games that do not
+    define setInput, so that a game that never looks at keysDown does not pay for the list each frame.
+    '''
+    __slots__ = ["keys","_list"]
+    def __init__(self,keys):
+        self.keys = keys
+        self._list = None
+
+    def list(self):
+        if self._list == None:
+            self._list = keyList(self.keys)
+        return self._list
+
+    def __contains__(self,k):
+        keys = self.keys
+        return keys != None and isinstance(k,int) and 0 <= k < len(keys) and bool(keys[k])
+
+    def __getitem__(self,i):
+        return self.list()[i]
+
+    def __len__(self):
+        return len(self.list())
+
+    def __iter__(self):
+        return iter(self.list())
+
+    def __eq__(self,other):
+        if isinstance(other,KeyView):
+            other = other.list()
+        return self.list() == other
+
+    def __ne__(self,other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.list())
+
+# start measuring startup again, e.g. just before a game module is imported
+def startupBegins():
+    _startup["start"] = perf_counter()
+
+# the seconds since startup began: since this library was imported, or since startupBegins() was last called
+def startupTime():
+    return perf_counter() - _startup["start"]
+
 # define global varibale for keyboard and mouse action
 mouseDown =None
 mouseX = None
@@ -1,8 +1,14 @@
 from EaselLib import *
 from random import choice
-from math import sqrt
+from math import sqrt, floor, ceil
+from heapq import heappush, heappop
+from collections import OrderedDict
 import sqlite3
-from pygame.transform import scale
+from pygame import Surface
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 '''
 MAEGEN:
@@ -40,6 +46,10 @@ The game will be played on a 10 * 10 grid of 60 pixel * 60 pixel cells,
 centered horizontally in the game window and whose upper edge is 50 pixels
 from the top of the game window.
 
+In large-map mode (see setMapMode), the grid is instead n * n cells for some
+n up to 256, each player has an army of k units, and the cells shrink so
+that the grid takes up the same area of the window.
+
 During movement and attack phases, units are selected by game-clicking the cell
 they are in. *Game-clicking* a space means moving the left mouse button
 from up to down while the cursor is in that space.
@@ -95,6 +105,18 @@ player's active units to the list of acted units (i.e. "passes" the turn).
 def windowDimensions():
     return (533,666)
 
+# dirtyRendering: bool
+# dirtyRendering() is True, so that Easel repaints and presents only the
+# parts of the window that changed since the last frame (see drawDirtyImages
+# in EaselLib).
+def dirtyRendering(): return True
+
+# eventDriven: bool
+# eventDriven() is True, so that Easel sleeps until there is input while the
+# screen is unchanged (display() keeps returning the same list) instead of
+# redrawing at the full frame rate while a player is thinking.
+def eventDriven(): return True
+
 # otherPlayer: player -> player
 # otherPlayer(S) is "black" if S is "red" and "red" otherwise.
 def otherPlayer(S):
@@ -103,14 +125,59 @@ def otherPlayer(S):
     return "black"
 
 # mapDimensions: int * int
-# mapDimensions() is (10,10)
+# mapDimensions() is (10,10), or (n,n) in large-map mode.
 # the game will not function if the two return values are different
-def mapDimensions(): return (10,10)
+def mapDimensions(): return (mapSize, mapSize)
+
+# setMapMode: int * int -> writeState
+# If n is an integer in {1..256} and k is a positive integer such that 2k is
+# at most n * n, setMapMode(n,k) sets mapSize to n and armySize to k, so that
+# the map is n * n cells and each player's army has k units, and rescales
+# the unit sprites to the new cellWidth(). It calls stateChanged(), so that
+# display() does not return a list drawn for the old map.
+# setMapMode(10,3), which is called when this file is loaded, sets up the
+# standard game. init() must be called after setMapMode for a new mode to
+# take effect.
+def setMapMode(n, k):
+    global mapSize
+    global armySize
+    global redArmy
+    global blackArmy
+    mapSize = n
+    armySize = k
+    redArmy = frozenset(range(1, k + 1))
+    blackArmy = frozenset(range(k + 1, 2 * k + 1))
+    scaleSprites()
+    stateChanged()
+
+# setHierarchy: int U {None} -> writeState
+# If c is a positive integer, setHierarchy(c) makes moveCost use hpaStar,
+# with the map split into clusters of c * c cells. setHierarchy(None), which
+# is called when this file is loaded, makes moveCost use aStar.
+# hpaStar pays off on large maps (see setMapMode), where aStar explores most
+# of the grid. This only affects moveCost, which the game itself does not
+# call; Move.reqs is answered by reachableCells either way.
+def setHierarchy(c):
+    global hierarchyCluster
+    global clusterTables
+    hierarchyCluster = c
+    clusterTables = dict()
+
+# vectorThreshold: int
+# vectorThreshold() is 16, the smallest number of units for which queries
+# over many units use numpy (when it is available) instead of a plain loop.
+# Below this, building the numpy arrays costs more than it saves.
+def vectorThreshold(): return 16
+
+# pathCacheSize: int
+# pathCacheSize() is 512, the most search results pathCache holds at once.
+def pathCacheSize(): return 512
 
 # cellWidth: int
-# cellWidth() is 60.
+# cellWidth() is 60 on a 10 * 10 map. On larger maps it shrinks in
+# proportion, so that the board stays the same size.
 def cellWidth():
-    return windowDimensions()[0]/13.333
+    return windowDimensions()[0]/13.333 * 10/mapDimensions()[0]
 
 # buttonDimensions: int * int
 # buttonDimensions() is (60,60)
@@ -376,14 +443,15 @@ class Move(PlayerAction):
     #   Unit self.u has not yet acted in the current phase.
     #   Cell self.B is unoccupied.
     #   The movement cost from unit self.u's location to cell self.B is less
-    #       than or equal to self.u's movement stat.
+    #       than or equal to self.u's movement stat (i.e. self.B is in
+    #       reachableCells(self.u)).
     def reqs(self):
         r1 = getCtrl() == ("move", self.p)
         r2 = self.u.index in army(self.p)
         r3 = onBoard(self.u)
         r4 = not (self.u.index in getActed())
         r5 = not occupied(self.B)
-        r6 = moveCost(unitLocation(self.u), self.B) <= movement(self.u)
+        r6 = self.B in reachableCells(self.u)
         return r1 and r2 and r3 and r4 and r5 and r6
 
     # effects: Move -> writeState
@@ -483,10 +551,7 @@ def onBoard(u):
 # occupied: cell * readState -> bool
 # If A is a cell, occupied(A) iff there is a unit whose location is A.
 def occupied(A):
-    for u in getRoster():
-        if unitLocation(u) == A:
-            return True
-    return False
+    return unitInCell(A) != None
 
 # coinResult: coin-side
 # coinResult() is "head" or "tail", chosen at random.
@@ -511,20 +576,107 @@ def armorRoll():
 # moveCost: cell * cell * readState -> R
 # if A and B are cells, then moveCost(A,B) is the cost of a shortest path
 # from A to B. If no such path exists, moveCost(A,B) is over nine thousand.
+# The path is found by hpaStar if setHierarchy has turned it on, and by
+# aStar otherwise, through cachedPath.
+# The game itself does not call moveCost: Move.reqs asks reachableCells,
+# which finds every cell in a unit's range with one bounded search. moveCost,
+# cachedPath and the hierarchical search are kept for callers (tools, AI
+# players, the benchmarks) that ask about single pairs of cells, possibly far
+# apart.
 def moveCost(A,B):
-    cost = aStar(A,B)[2]
+    cost = cachedPath(A,B)[2]
     if cost != -1:
         return cost
     return 9000.1
 
+# cachedPath: cell * cell * readState -> path * R * R
+# cachedPath(A,B) is hierarchySearch(A,B) if setHierarchy has turned hpaStar
+# on, and aStar(A,B) otherwise.
+# Results are kept in pathCache, keyed by A, B, occupancyVersion and
+# hierarchyCluster, so a question asked again before any unit moves is
+# answered without searching. Since setLocation bumps occupancyVersion, a
+# result is never served once the board has changed. pathCache holds at most
+# pathCacheSize() results, and drops the least recently used one when full.
+# pathCounts counts the hits and misses (see pathCacheStats).
+# Only moveCost calls cachedPath; see moveCost for who calls that.
+def cachedPath(A,B):
+    key = (A, B, occupancyVersion, hierarchyCluster)
+    if key in pathCache:
+        pathCounts["hits"] += 1
+        pathCache.move_to_end(key)
+        return pathCache[key]
+    pathCounts["misses"] += 1
+    if hierarchyCluster != None:
+        result = hierarchySearch(A,B)
+    else:
+        result = aStar(A,B)
+    pathCache[key] = result
+    if len(pathCache) > pathCacheSize():
+        pathCache.popitem(last=False)
+    return result
+
+# pathCacheStats: readState -> int * int
+# pathCacheStats() is (h, m), where h and m are the numbers of cachedPath
+# calls since init() that were and were not answered from pathCache.
+def pathCacheStats():
+    return (pathCounts["hits"], pathCounts["misses"])
+
 # aStar: cell * cell * readState -> path * R * R
-# aStar implements the A* algorithm.
+# aStar implements the A* algorithm, using a binary heap as the open list,
+# a table of the best known cost to each cell, and parent pointers from which
+# the path is rebuilt once b is reached.
 # If a and b are tiles such that a does not equal b,
 # then if there is a traversable path from a to b,
 # aStar(a,b) is (p, f, f), where p is the shortest traversable path from
 # a to b, and f is the path length of p.
 # If there is no traversable path from a to b, aStar(a,b) is ([],-1,-1).
+# If a is an unoccupied cell, aStar(a,a) is ([a], 0.0, 0.0), as for
+# hierarchySearch, so moveCost(a,a) is 0. (listAStar, which only stops when
+# it steps onto b, gives a round trip through a neighbour instead, e.g.
+# ([a, n, a], 2.0, 2.0), or ([],-1,-1) if a has no unoccupied neighbours.)
 def aStar(a,b):
+    if occupied(b): return ([],-1,-1)
+    openList = [(cellDist(a,b), 0.0, a)]
+    bestCost = {a: 0.0}
+    parent = {a: None}
+    closedList = set()
+    while len(openList) > 0:
+        (f, curDist, lastCell) = heappop(openList)
+        if lastCell in closedList:
+            continue
+        if lastCell == b:
+            return (tracePath(parent, b), curDist, curDist)
+        closedList.add(lastCell)
+        edges = (edgeAdjacents(lastCell), 1.0)
+        diags = (diagAdjacents(lastCell), 1.5)
+
+        for adjs, dist in [edges, diags]:
+            for s in adjs:
+                g = curDist + dist
+                if s in closedList or g >= bestCost.get(s, g + 1):
+                    continue
+                bestCost[s] = g
+                parent[s] = lastCell
+                heappush(openList, (g + cellDist(s,b), g, s))
+    return ([],-1,-1)
+
+# tracePath: dict * cell -> path
+# If parent maps each cell reached by a search to the cell it was reached
+# from (and the start cell to None), and c is a key of parent, then
+# tracePath(parent, c) is the path from the start cell to c.
+def tracePath(parent, c):
+    path = []
+    while c != None:
+        path.append(c)
+        c = parent[c]
+    path.reverse()
+    return path
+
+# listAStar: cell * cell * readState -> path * R * R
+# listAStar(a,b) is the original list-based implementation of aStar(a,b),
+# which keeps whole paths in its open and closed lists. It is kept as a
+# reference for testing and benchmarking aStar.
+def listAStar(a,b):
     if occupied(b): return ([],-1,-1)
     openList = [([a], 0, 0)]
     closedList = []
@@ -549,21 +701,89 @@ def aStar(a,b):
         closedList += [q]
     return ([],-1,-1)
 
+# reachableCells: Unit * readState -> dict
+# If u is a unit on the board, reachableCells(u) is a dict mapping each cell
+# B other than u's location such that moveCost(unitLocation(u), B) is less
+# than or equal to movement(u) to moveCost(unitLocation(u), B).
+# If u is not on the board, reachableCells(u) is an empty dict.
+# The dict is computed by a single Dijkstra search bounded by movement(u),
+# and is kept in reachCache until the next call to setLocation, so it must
+# not be modified by the caller.
+def reachableCells(u):
+    if u.index in reachCache:
+        return reachCache[u.index]
+    out = dict()
+    start = unitLocation(u)
+    if start != None:
+        budget = movement(u)
+        bestCost = {start: 0.0}
+        openList = [(0.0, start)]
+        while len(openList) > 0:
+            (curDist, lastCell) = heappop(openList)
+            if curDist > bestCost[lastCell]:
+                continue
+            if lastCell != start:
+                out[lastCell] = curDist
+            edges = (edgeAdjacents(lastCell), 1.0)
+            diags = (diagAdjacents(lastCell), 1.5)
+            for adjs, dist in [edges, diags]:
+                for s in adjs:
+                    g = curDist + dist
+                    if g <= budget and g < bestCost.get(s, g + 1):
+                        bestCost[s] = g
+                        heappush(openList, (g, s))
+    reachCache[u.index] = out
+    return out
+
 # cellDist: cell * cell -> R
 # If C1 and C2 are cells, cellDist(C1, C2) is the cost of the shortest
-# path (occupied or not) between C1 and C2.
+# path (occupied or not) between C1 and C2. Such a path takes as many 1.5
+# diagonal steps as the smaller of the horizontal and vertical distances
+# between C1 and C2, and makes up the rest of the larger with 1.0 steps.
 def cellDist(C1, C2):
-    xMax = max({C1[0], C2[0]})
-    yMax = max({C1[1], C2[1]})
-    xMin = min({C1[0], C2[0]})
-    yMin = min({C1[1], C2[1]})
-    count = 0.0
-    while (xMax != xMin and yMax != yMin):
-        xMax -= 1
-        yMax -= 1
-        count += 1.5
-    count += (xMax - xMin) + (yMax - yMin)
-    return count
+    dx = abs(C1[0] - C2[0])
+    dy = abs(C1[1] - C2[1])
+    if dx < dy:
+        return dy + 0.5 * dx
+    return dx + 0.5 * dy
+
+# cellDistMatrix: readState -> numpy.ndarray U {None}
+# If numpy is available, cellDistMatrix() is the n * n array whose entry
+# [cellIndex(C1), cellIndex(C2)] is cellDist(C1, C2), where n is the number
+# of cells on the map. Otherwise, cellDistMatrix() is None.
+# The array is built the first time it is asked for after init() and kept
+# in distMatrices. It takes 8 * n * n bytes, so it is meant for maps of up
+# to about 64 * 64 cells.
+def cellDistMatrix():
+    if not numpy:
+        return None
+    if not "cellDist" in distMatrices:
+        (dx, dy) = cellOffsets()
+        distMatrices["cellDist"] = numpy.maximum(dx, dy) + 0.5 * numpy.minimum(dx, dy)
+    return distMatrices["cellDist"]
+
+# lineDistMatrix: readState -> numpy.ndarray U {None}
+# If numpy is available, lineDistMatrix() is the n * n array whose entry
+# [cellIndex(C1), cellIndex(C2)] is straightLineDistance(C1, C2), where n is
+# the number of cells on the map. Otherwise, lineDistMatrix() is None.
+# As with cellDistMatrix(), the array is built on first use after init().
+def lineDistMatrix():
+    if not numpy:
+        return None
+    if not "lineDist" in distMatrices:
+        (dx, dy) = cellOffsets()
+        distMatrices["lineDist"] = numpy.sqrt(dx * dx + dy * dy)
+    return distMatrices["lineDist"]
+
+# cellOffsets: numpy.ndarray * numpy.ndarray
+# cellOffsets() is a pair of n * n arrays (dx, dy), where n is the number of
+# cells on the map, whose entries [cellIndex(C1), cellIndex(C2)] are the
+# horizontal and vertical distances between C1 and C2.
+def cellOffsets():
+    cells = numpy.array(allCells(), dtype=float)
+    dx = numpy.abs(cells[:, 0, None] - cells[None, :, 0])
+    dy = numpy.abs(cells[:, 1, None] - cells[None, :, 1])
+    return (dx, dy)
 
 # edgeAdjacents: cell * readState -> list(cell)
 # If c is a cell, then edgeAdjacents(c) is the list of unoccupied
@@ -587,14 +807,30 @@ def diagAdjacents(c):
             out += [n]
     return out
 
+# adjacents: cell * readState -> list(cell * R)
+# If c is a cell, adjacents(c) is the list of pairs (n, d) such that n is an
+# unoccupied cell adjacent to c, and d is 1.0 if n is edge-adjacent to c and
+# 1.5 if n is diagonally adjacent to c.
+def adjacents(c):
+    out = [(n, 1.0) for n in edgeAdjacents(c)]
+    out += [(n, 1.5) for n in diagAdjacents(c)]
+    return out
+
 # validCell: int * int -> bool
 # If C is a pair of integers, validCell(C) iff C is a cell.
 def validCell(C):
     (x,y) = C
-    t1 = 1 <= x and x <= 10
-    t2 = 1 <= y and y <= 10
+    (columns, rows) = mapDimensions()
+    t1 = 1 <= x and x <= columns
+    t2 = 1 <= y and y <= rows
     return t1 and t2
 
+# allCells: list(cell)
+# allCells() is the list of every cell on the map, ordered by cellIndex.
+def allCells():
+    (columns, rows) = mapDimensions()
+    return [(x,y) for y in range(1, rows + 1) for x in range(1, columns + 1)]
+
 # pairAdd: (R * R) * (R * R) -> R * R
 # if p1 and p2 are pairs of reals, pairAdd(p1,p2) is the pair (x,y), where x
 # is the sum of the first coordinates of p1 and p2, and y is the sum of
@@ -640,8 +876,88 @@ def straightLineDistance(A,B):
 # by the line from l1's center to l2's center, with the exception of l1 and
 # l2, are unoccupied.
 def clearLineOfAttack(l1, l2):
-    trail = lineOfAttackSet(l1,l2).difference({l1,l2})
-    return allUnoccupied(trail)
+    (mask, k) = lineOfAttackTrail(l1, l2)
+    return (occupiedMask >> k) & mask == 0
+
+# attackTargets: Unit * readState -> list(Unit)
+# If u is a unit on the board, attackTargets(u) is the list of units v on the
+# board in the other player's army such that the straight-line distance from
+# u's location to v's location is less than or equal to u's range, and there
+# is a clear line of attack from u's location to v's location. (That is,
+# the targets v for which the requirements of an Attack by u on v that
+# concern v are met.)
+# If u is not on the board, attackTargets(u) is [].
+# If numpy is available and there are at least vectorThreshold() enemies on
+# the board, the range check is done for all of them at once.
+def attackTargets(u):
+    l1 = unitLocation(u)
+    if l1 == None:
+        return []
+    if u.index in army("red"):
+        enemyArmy = army("black")
+    else:
+        enemyArmy = army("red")
+    enemies = [v for v in getRoster() if v.index in enemyArmy and onBoard(v)]
+    r = unitRange(u)
+    if numpy and len(enemies) >= vectorThreshold():
+        cells = numpy.array([unitLocation(v) for v in enemies])
+        d = cells - numpy.array(l1)
+        inRange = numpy.flatnonzero((d * d).sum(axis=1) <= r * r)
+        enemies = [enemies[i] for i in inRange]
+    else:
+        enemies = [v for v in enemies if straightLineDistance(l1, unitLocation(v)) <= r]
+    return [v for v in enemies if clearLineOfAttack(l1, unitLocation(v))]
+
+# lineOfAttackMask: cell * cell * readState -> int
+# If l1 and l2 are cells, lineOfAttackMask(l1,l2) is cellMask(S), where S is
+# lineOfAttackSet(l1,l2) without l1 and l2.
+def lineOfAttackMask(l1, l2):
+    (mask, k) = lineOfAttackTrail(l1, l2)
+    return mask << k
+
+# lineOfAttackTrail: cell * cell * readState -> int * int
+# If l1 and l2 are cells, lineOfAttackTrail(l1,l2) is a pair (m,k) such that
+# m << k is lineOfAttackMask(l1,l2).
+# As lineOfAttackSet(l1,l2) is lineOfAttackSet((0,0),d) moved by l1, where d
+# is l2 - l1, (m,k) is found from offsetTrail(d), which is read from
+# lineTable, and computed and stored there the first time d is asked for if
+# initLineTable() did not fill it in.
+def lineOfAttackTrail(l1, l2):
+    d = (l2[0] - l1[0], l2[1] - l1[1])
+    trail = lineTable.get(d)
+    if trail == None:
+        trail = offsetTrail(d)
+        lineTable[d] = trail
+    return (trail[0], cellIndex(l1) + trail[1])
+
+# offsetTrail: (int * int) -> int * int
+# If d is a pair of integers, let S be lineOfAttackSet((0,0),d) without (0,0)
+# and d, and let i(x,y) be y * mapDimensions()[0] + x (so that cellIndex(C)
+# plus i(x,y) is cellIndex(pairAdd(C, (x,y)))).
+# If S is empty, offsetTrail(d) is (0,0). Otherwise, offsetTrail(d) is (m,b),
+# where b is the least i(x,y) for (x,y) in S, and m is the integer whose
+# bit number i(x,y) - b is set for every (x,y) in S, and whose other bits
+# are clear.
+def offsetTrail(d):
+    columns = mapDimensions()[0]
+    S = lineOfAttackSet((0,0), d).difference({(0,0), d})
+    offsets = [y * columns + x for (x,y) in S]
+    if len(offsets) == 0:
+        return (0, 0)
+    b = min(offsets)
+    m = 0
+    for i in offsets:
+        m |= 1 << (i - b)
+    return (m, b)
+
+# cellMask: set(cell) -> int
+# If S is a set of cells, cellMask(S) is the integer whose bit number
+# cellIndex(C) is set for every C in S, and whose other bits are clear.
+def cellMask(S):
+    mask = 0
+    for C in S:
+        mask |= 1 << cellIndex(C)
+    return mask
 
 # lineOfAttackSet: cell * cell -> set(cell)
 # If l1 and l2 are cells, lineOfAttackSet(l1, l2) is the set of all cells
@@ -668,13 +984,16 @@ def allUnoccupied(p):
     return True
 
 # army: player -> set(int)
-# army(p) is {1,2,3} if p is red, {4,5,6} if p is black, and {} otherwise.
+# army(p) is {1..k} if p is red, {k+1..2k} if p is black, and {} otherwise,
+# where k is armySize (so {1,2,3} and {4,5,6} in the standard game).
+# The sets are frozensets, shared by every caller, so that no caller can
+# change an army (and with it the units the occupancy index is built from).
 def army(p):
     if p == "red":
-        return {1,2,3}
+        return redArmy
     elif p == "black":
-            return {4,5,6}
-    return {}
+            return blackArmy
+    return frozenset()
 
 # activeUnits: player * readState -> set(int)
 # If p is a player, activeUnits(p) is the set of members of army(p) that are
@@ -715,14 +1034,342 @@ def winner():
         return "black"
     return "red"
 
-# unitInCell: cell -> Unit U {None}
+# unitInCell: cell * readState -> Unit U {None}
 # If C is a cell, then unitInCell(C) is a unit in C, or
 # None if no such unit exists.
 def unitInCell(C):
-    for u in getRoster():
-        if unitLocation(u) == C:
-            return u
-    return None
+    if not validCell(C):
+        return None
+    return occupancy[cellIndex(C)]
+
+# cellIndex: cell -> int
+# If C is a cell, cellIndex(C) is the position of C in a flat list of all
+# cells, ordered by row and then by column (so cellIndex((1,1)) is 0).
+def cellIndex(C):
+    return (C[1] - 1) * mapDimensions()[0] + C[0] - 1
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+#==============================
+'''Hierarchical Pathfinding'''
+#==============================
+
+# hpaStar splits the map into square clusters of hierarchyCluster *
+# hierarchyCluster cells (see setHierarchy), and searches a graph whose nodes
+# are the *border cells* of the clusters: the unoccupied cells that are
+# adjacent (edge or diagonal) to a cell of another cluster, occupied or not.
+# Within a cluster, each border cell has an edge to every other border cell
+# it can reach without leaving the cluster, with the cost of the shortest
+# such path. These edges are computed the first time the cluster is searched
+# and kept in clusterTables until setLocation changes the occupancy of the
+# cluster. Between clusters, border cells are joined by the usual 1.0 edge
+# and 1.5 diagonal moves.
+# Every border cell is a node (rather than one per run of border cells, as
+# in the usual HPA*), so the cost found by hpaStar is always the same as the
+# cost found by aStar.
+# Like aStar, hpaStar is a library search for moveCost's callers (see
+# moveCost): no game action uses it.
+
+# hpaStar: cell * cell * readState -> path * R * R
+# If a and b are cells, hpaStar(a,b) is the same as aStar(a,b), except that
+# the path may be a different path of the same length.
+def hpaStar(a,b):
+    (p, f, g) = hierarchySearch(a,b)
+    return (refinePath(p), f, g)
+
+# hierarchySearch: cell * cell * readState -> path * R * R
+# If a and b are cells, hierarchySearch(a,b) is (p, f, f), where f is the
+# cost of hpaStar(a,b) and p is the list of border cells (starting with a
+# and ending with b) that hpaStar(a,b)'s path passes through, or ([],-1,-1)
+# if there is no traversable path from a to b.
+# Only the clusters of a and b are searched cell by cell; moveCost uses
+# hierarchySearch directly, as it does not need the refined path.
+def hierarchySearch(a,b):
+    if occupied(b): return ([],-1,-1)
+    if a == b: return ([a], 0.0, 0.0)
+    fromA = clusterDistances(a)[0]
+    toB = clusterDistances(b)[0]
+    kb = clusterOf(b)
+    openList = [(cellDist(a,b), 0.0, a)]
+    bestCost = {a: 0.0}
+    parent = {a: None}
+    closedList = set()
+    while len(openList) > 0:
+        (f, curDist, lastCell) = heappop(openList)
+        if lastCell in closedList:
+            continue
+        if lastCell == b:
+            return (tracePath(parent, b), curDist, curDist)
+        closedList.add(lastCell)
+        k = clusterOf(lastCell)
+        table = clusterTable(k)[1]
+        if lastCell == a:
+            adjs = [(s, d) for (s, d) in fromA.items() if s in table or s == b]
+        else:
+            adjs = table[lastCell]
+        adjs = adjs + borderAdjacents(lastCell)
+        if k == kb and lastCell in toB:
+            adjs = adjs + [(b, toB[lastCell])]
+        for (s, dist) in adjs:
+            g = curDist + dist
+            if s in closedList or g >= bestCost.get(s, g + 1):
+                continue
+            bestCost[s] = g
+            parent[s] = lastCell
+            heappush(openList, (g + cellDist(s,b), g, s))
+    return ([],-1,-1)
+
+# refinePath: path * readState -> path
+# If p is a path found by hierarchySearch, refinePath(p) is the path of
+# cells p stands for: each step of p between two cells of one cluster is
+# replaced by the shortest path between them inside that cluster.
+def refinePath(p):
+    out = p[:1]
+    for i in range(1, len(p)):
+        (c1, c2) = (p[i-1], p[i])
+        if clusterOf(c1) != clusterOf(c2):
+            out.append(c2)
+        else:
+            out += tracePath(clusterDistances(c1)[1], c2)[1:]
+    return out
+
+# clusterOf: cell -> int * int
+# If C is a cell, clusterOf(C) is the pair (i,j) such that C is in the
+# (i+1)th column and (j+1)th row of clusters.
+def clusterOf(C):
+    return ((C[0] - 1) // hierarchyCluster, (C[1] - 1) // hierarchyCluster)
+
+# clusterCells: (int * int) -> list(cell)
+# If k is a cluster, clusterCells(k) is the list of cells in k.
+def clusterCells(k):
+    (columns, rows) = mapDimensions()
+    c = hierarchyCluster
+    xs = range(k[0] * c + 1, min((k[0] + 1) * c, columns) + 1)
+    ys = range(k[1] * c + 1, min((k[1] + 1) * c, rows) + 1)
+    return [(x,y) for y in ys for x in xs]
+
+# onClusterEdge: cell -> bool
+# If C is a cell, onClusterEdge(C) iff some cell adjacent to C is in a
+# different cluster.
+def onClusterEdge(C):
+    c = hierarchyCluster
+    (columns, rows) = mapDimensions()
+    (x, y) = C
+    left = (x - 1) % c == 0 and x > 1
+    right = x % c == 0 and x < columns
+    bottom = (y - 1) % c == 0 and y > 1
+    top = y % c == 0 and y < rows
+    return left or right or bottom or top
+
+# borderAdjacents: cell * readState -> list(cell * R)
+# If C is a cell, borderAdjacents(C) is the list of pairs (n, d) such that n
+# is an unoccupied cell adjacent to C in a different cluster, and d is 1.0
+# if n is edge-adjacent to C and 1.5 if n is diagonally adjacent to C.
+def borderAdjacents(C):
+    k = clusterOf(C)
+    out = [(n, 1.0) for n in edgeAdjacents(C) if clusterOf(n) != k]
+    out += [(n, 1.5) for n in diagAdjacents(C) if clusterOf(n) != k]
+    return out
+
+# clusterAdjacents: cell * readState -> list(cell * R)
+# If C is a cell, clusterAdjacents(C) is the list of pairs (n, d) such that
+# n is an unoccupied cell adjacent to C in the same cluster, and d is 1.0 if
+# n is edge-adjacent to C and 1.5 if n is diagonally adjacent to C.
+def clusterAdjacents(C):
+    k = clusterOf(C)
+    out = [(n, 1.0) for n in edgeAdjacents(C) if clusterOf(n) == k]
+    out += [(n, 1.5) for n in diagAdjacents(C) if clusterOf(n) == k]
+    return out
+
+# clusterDistances: cell * readState -> dict * dict
+# If C is a cell, clusterDistances(C) is a pair (d, p) of dicts, where d maps
+# each unoccupied cell B in C's cluster, other than C, that can be reached
+# from C without leaving the cluster, to the cost of the shortest such path,
+# and p maps each such B to the cell before it on that path (and C to None).
+def clusterDistances(C):
+    graph = clusterTable(clusterOf(C))[0]
+    out = dict()
+    bestCost = {C: 0.0}
+    parent = {C: None}
+    openList = [(0.0, C)]
+    while len(openList) > 0:
+        (curDist, lastCell) = heappop(openList)
+        if curDist > bestCost[lastCell]:
+            continue
+        if lastCell != C:
+            out[lastCell] = curDist
+            adjs = graph[lastCell]
+        else:
+            adjs = clusterAdjacents(C)
+        for (s, dist) in adjs:
+            g = curDist + dist
+            if g < bestCost.get(s, g + 1):
+                bestCost[s] = g
+                parent[s] = lastCell
+                heappush(openList, (g, s))
+    return (out, parent)
+
+# clusterTable: (int * int) * readState -> dict * dict
+# If k is a cluster, clusterTable(k) is a pair (graph, table) of dicts.
+# graph maps each unoccupied cell C of k to clusterAdjacents(C). table maps
+# each border cell B of k to the list of pairs (B2, d), where B2 is another
+# border cell of k and d is the cost of the shortest path from B to B2
+# inside k.
+# The pair is built the first time k is asked for and kept in clusterTables
+# until setLocation changes the occupancy of k.
+def clusterTable(k):
+    entry = clusterTables.get(k)
+    if entry == None:
+        cells = [C for C in clusterCells(k) if not occupied(C)]
+        graph = dict()
+        for C in cells:
+            graph[C] = clusterAdjacents(C)
+        table = dict()
+        entry = (graph, table)
+        clusterTables[k] = entry
+        border = [C for C in cells if onClusterEdge(C)]
+        for B in border:
+            d = clusterDistances(B)[0]
+            table[B] = [(B2, d[B2]) for B2 in border if B2 in d]
+    return entry
+
+# repairHierarchy: cell -> writeState
+# If C is a cell whose occupancy has changed, repairHierarchy(C) drops the
+# entry for C's cluster from clusterTables, so that it is rebuilt the next
+# time it is needed. The entries for other clusters are unaffected.
+def repairHierarchy(C):
+    clusterTables.pop(clusterOf(C), None)
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+#================
+'''Flow Fields'''
+#================
+
+# A flow field for a goal cell G answers "which way to G, and how far?" for
+# every cell at once, so that any number of units heading for G can share a
+# single search. It is made of an *integration field*, mapping each cell to
+# its move cost to G, and a *direction field*, mapping each cell to the next
+# cell on a shortest path to G. Both come from one Dijkstra search outwards
+# from G, using the same moves, costs and occupancy rules as aStar.
+# Fields are kept in flowFields until the next call to setLocation.
+
+# flowField: cell * readState -> dict * dict
+# If G is a cell, flowField(G) is a pair (cost, step) of dicts, where cost
+# maps G and each unoccupied cell C from which G can be reached to the cost
+# of a shortest path from C to G, and step maps G to None and each such C to
+# the next cell on such a path. If G is occupied, the paths are those G's
+# occupant could take, so that units can close in on it.
+# The pair is kept in flowFields until the next call to setLocation, so it
+# must not be modified by the caller.
+def flowField(G):
+    field = flowFields.get(G)
+    if field == None:
+        cost = {G: 0.0}
+        step = {G: None}
+        openList = [(0.0, G)]
+        while len(openList) > 0:
+            (curDist, lastCell) = heappop(openList)
+            if curDist > cost[lastCell]:
+                continue
+            for (s, dist) in adjacents(lastCell):
+                g = curDist + dist
+                if g < cost.get(s, g + 1):
+                    cost[s] = g
+                    step[s] = lastCell
+                    heappush(openList, (g, s))
+        field = (cost, step)
+        flowFields[G] = field
+    return field
+
+# flowCost: cell * cell * readState -> R
+# If C and G are cells and G is unoccupied, flowCost(C,G) is moveCost(C,G),
+# read from flowField(G) (so C may be the location of a unit).
+def flowCost(C, G):
+    cost = flowField(G)[0]
+    if C in cost:
+        return cost[C]
+    out = [dist + cost[n] for (n, dist) in adjacents(C) if n in cost]
+    if len(out) > 0:
+        return min(out)
+    return 9000.1
+
+# flowStep: cell * cell * readState -> cell U {None}
+# If C and G are cells, flowStep(C,G) is the next cell on a shortest path
+# from C to G, read from flowField(G), or None if C is G or there is no path
+# from C to G.
+def flowStep(C, G):
+    (cost, step) = flowField(G)
+    if C in step:
+        return step[C]
+    best = None
+    for (n, dist) in adjacents(C):
+        if n in cost and (best == None or dist + cost[n] < best[0]):
+            best = (dist + cost[n], n)
+    if best == None:
+        return None
+    return best[1]
+
+# flowMoves: player * cell * readState -> list(PlayerAction)
+# If p is a player and G is a cell, flowMoves(p,G) is a list of Moves, one
+# for each of p's active units u that has not acted and can get closer to G,
+# moving u as far along its flowStep route to G as movement(u) allows.
+# Units are routed in order of index, and a route stops short of any cell
+# an earlier unit is moving to, so that the Moves can be queued and carried
+# out in order.
+def flowMoves(p, G):
+    out = []
+    claimed = set()
+    for i in sorted(activeUnits(p) - getActed()):
+        u = unitWithIndex(i)
+        C = unitLocation(u)
+        spent = 0.0
+        B = None
+        n = flowStep(C, G)
+        while n != None and not n in claimed and not occupied(n):
+            spent += cellDist(C, n)
+            if spent > movement(u):
+                break
+            (C, B) = (n, n)
+            n = flowStep(n, G)
+        if B != None:
+            claimed.add(B)
+            out.append(Move(p, u, B))
+    return out
 
 
 
@@ -768,6 +1415,27 @@ def update():
             a.effects()
     setActionQueue([])
 
+# phaseMusic: string * player -> string
+# If phase is "move" or "attack", phaseMusic(phase,p) is the name of the music
+# file played during p's phase: Slinger music for red, Swordsman music for black.
+def phaseMusic(phase, p):
+    if p == "red":
+        return Slinger_Move_Music if phase == "move" else Slinger_Attack_Music
+    return Swordsman_Move_Music if phase == "move" else Swordsman_Attack_Music
+
+# playPhaseMusic: readState ~> None
+# If ctrl is a move or attack phase, playPhaseMusic() switches the background
+# music to that phase's track, and starts reading the track of the phase that
+# follows it in the background, so that switching to it later doesn't wait on
+# the disk.
+def playPhaseMusic():
+    (phase, p) = getCtrl()
+    playBackGroundMusic(phaseMusic(phase, p))
+    if phase == "move":
+        preloadMusic([phaseMusic("attack", p)])
+    else:
+        preloadMusic([phaseMusic("move", otherPlayer(p))])
+
 # autoEvents() implements the automatic game events described in the
 # architecture document. When one of these events is executed, autoEvents()
 # immediately returns true, without checking any further events.
@@ -779,34 +1447,26 @@ def autoEvents():
     if getCtrl() == ("deploy", getFirstPlayer()):
         if allPlaced(army(getFirstPlayer())):
             setCtrl(("deploy", getSecondPlayer()))
+            preloadMusic([phaseMusic("move", getFirstPlayer())])
             setActed(set())
             return True
     if getCtrl() == ("deploy", getSecondPlayer()):
         if allPlaced(army(getSecondPlayer())):
             setCtrl(("move", getFirstPlayer()))
-            if getFirstPlayer() == "red":
-                playBackGroundMusic(Slinger_Move_Music)
-            else:
-                playBackGroundMusic(Swordsman_Move_Music)
+            playPhaseMusic()
             setActed(set())
             return True
     if getCtrl()[0] == "move":
         if activeUnits(currentPlayer()) <= getActed(): # subset, in case any
                                                        # dead units in acted
             setCtrl(("attack", currentPlayer()))
-            if currentPlayer() == "red":
-                playBackGroundMusic(Slinger_Attack_Music)
-            else:
-                playBackGroundMusic(Swordsman_Attack_Music)
+            playPhaseMusic()
             setActed(set())
             return True
     if getCtrl()[0] == "attack":
         if activeUnits(currentPlayer()) <= getActed():
             setCtrl(("move", otherPlayer(currentPlayer())))
-            if currentPlayer() == "red":
-                playBackGroundMusic(Slinger_Move_Music)
-            else:
-                playBackGroundMusic(Swordsman_Move_Music)
+            playPhaseMusic()
             setActed(set())
             return True
     return False
@@ -950,16 +1610,25 @@ def placeNextUnit(p, C):
             queueAction(Place(p, u, C))
             return
 
+# setInput: UserInput -> writeState
+# If I is a UserInput, setInput(I) sets userInput to I. Easel calls it once,
+# and then fills in I with the input of each frame, which the functions below
+# read. setInput(UserInput()), with the mouse up, is called when this file is
+# loaded.
+def setInput(I):
+    global userInput
+    userInput = I
+
 # gameClicked: readInput -> bool
 # gameClicked() means the left mouse button was clicked this frame.
 def gameClicked():
-    return mouseDown and not oldMouseDown
+    return userInput.mouseDown and not userInput.oldMouseDown
 
 # areaClicked: Rectangle * readInput -> bool
 # If R is a rectangle, areaClicked(R) if the area represented by R
 # was game-clicked this frame.
 def areaClicked(R):
-    return gameClicked() and R.containsPoint((mouseX, mouseY))
+    return gameClicked() and R.containsPoint((userInput.mouseX, userInput.mouseY))
 
 # button1: readInput -> bool
 # button1() iff the area occupied by button 1 was game-clicked this frame.
@@ -974,17 +1643,17 @@ def button2():
 # clickedCell: readState -> (int * int) U {None}
 # If a cell C's interior has been game-clicked this frame, clickedCell() is
 # C. Otherwise, clickedCell() is None.
+# C is worked out from the mouse position's offset from the bottom-left
+# corner of board(), so no cell other than C is looked at.
 def clickedCell():
+    if not gameClicked():
+        return None
     w = cellWidth()
-    xRoot = -((mapDimensions()[0] % 2) * w/2) - ((int(mapDimensions()[0]/2) + 1) * w)
-    yRoot = (-verticalOffset()) - ((int(mapDimensions()[1] - 10)/2) * w)
-    root = (xRoot, yRoot)
-    if gameClicked():
-        for x in range(1,mapDimensions()[0] + 1):
-            for y in range(1,mapDimensions()[1] + 1):
-                (left, top) = pairAdd(root, (x*w, y*w))
-                if areaClicked(Rectangle(left, top, w, w)):
-                    return (x,y)
+    b = board()
+    x = floor((userInput.mouseX - b.left) / w) + 1
+    y = ceil((userInput.mouseY - (b.top - b.height)) / w)
+    if validCell((x,y)):
+        return (x,y)
     return None
 
 
@@ -1014,14 +1683,35 @@ def clickedCell():
 # the actual database is functional
 
 # init: readState -> writeState
-# init() initializes unit statistics, the unit roster, the state variables,
-# the action queue, and the interface variables.
+# init() initializes the display cache, unit statistics, the unit roster,
+# the state variables, the action queue, and the interface variables.
 def init():
+    initDisplayCache()
     initStats()
     initRoster()
     initStateVars()
     initActions()
     initInterface()
+    initLineTable()
+    initDistances()
+
+# initDisplayCache: writeState
+# initDisplayCache() initializes stateVersion to 0 and displayCache to None.
+# stateVersion counts the changes made to the game state through its setters
+# (see stateChanged), and displayCache holds the last list built by display()
+# together with the stateVersion it was built for.
+def initDisplayCache():
+    global stateVersion
+    global displayCache
+    stateVersion = 0
+    displayCache = None
+
+# stateChanged: writeState
+# stateChanged() adds 1 to stateVersion, so that the next call to display()
+# builds its list again. Every setter of the game state calls it.
+def stateChanged():
+    global stateVersion
+    stateVersion += 1
 
 # initStats: writeState
 # initStats() initializes a dict stats, such that for each unit type t,
@@ -1038,18 +1728,29 @@ def getStats():
     return stats
 
 # initRoster: writeState
-# initRoster() initializes roster as follows:
+# initRoster() initializes roster, and units, a dict indexing roster by unit
+# index, as follows:
 #   For each unit index i in red's army, a Slinger with index i is added to
 #       roster.
 #   For each unit index i in black's army, a Swordsman with index i is added to
 #       roster.
 def initRoster():
     global roster
+    global units
     roster = set()
+    units = dict()
     for i in army("red"):
-        roster = roster | { Slinger(i) }
+        addUnit(Slinger(i))
     for i in army("black"):
-        roster = roster | { Swordsman(i) }
+        addUnit(Swordsman(i))
+
+# addUnit: Unit -> writeState
+# If u is a unit whose index is not the index of any unit in roster,
+# addUnit(u) adds u to roster and adds the key-value pair (u.index:u) to units.
+def addUnit(u):
+    stateChanged()
+    roster.add(u)
+    units[u.index] = u
 
 # getRoster: readState: set(Unit)
 # getRoster() returns roster.
@@ -1058,12 +1759,37 @@ def getRoster():
 
 # initLoaction: readState -> writeState
 # initLocation() initializes location, setting the locations
-# of all units to None.
+# of all units to None, and initializes occupancy to a list with one None
+# for each cell on the map and occupiedMask to 0.
+# occupancy is an index of location: occupancy[cellIndex(C)] is the unit
+# whose location is C, or None if C is unoccupied. occupiedMask is
+# cellMask(S), where S is the set of occupied cells. Both are kept up to
+# date by setLocation.
+# initLocation() also initializes reachCache, which holds the results of
+# reachableCells by unit index, and flowFields, which holds the results of
+# flowField by goal cell, to empty dicts, empties clusterTables, and sets
+# up an empty pathCache for cachedPath, with occupancyVersion and the counts
+# in pathCounts at 0.
 def initLocation():
     global location
+    global occupancy
+    global reachCache
+    global flowFields
+    global occupiedMask
+    global occupancyVersion
+    global pathCache
+    global pathCounts
     location = dict()
     for u in getRoster():
         location[u.index] = None
+    occupancy = [None] * (mapDimensions()[0] * mapDimensions()[1])
+    occupiedMask = 0
+    reachCache = dict()
+    flowFields = dict()
+    occupancyVersion = 0
+    pathCache = OrderedDict()
+    pathCounts = {"hits": 0, "misses": 0}
+    clusterTables.clear()
 
 # unitLocation: Unit * readState -> Cell
 # If u is a unit, unitLocation(u) is the location of u (i.e. the value in
@@ -1079,7 +1805,28 @@ def getLocation():
 # If u is a unit and C is a cell, setLocation(u,C) reassigns the key u.index to
 # the value of C in location. If u.index has no value in location, the key-
 # value pair (u.index:C) is added to location.
+# setLocation(u,C) also moves u from its old cell to C in occupancy and
+# occupiedMask, empties reachCache and flowFields, bumps occupancyVersion so
+# that pathCache is not consulted for the old board, and repairs the hpaStar
+# cluster tables around the old cell and C.
 def setLocation(u,C):
+    global occupiedMask
+    global occupancyVersion
+    occupancyVersion += 1
+    stateChanged()
+    reachCache.clear()
+    flowFields.clear()
+    old = location.get(u.index)
+    if old != None and occupancy[cellIndex(old)] == u:
+        occupancy[cellIndex(old)] = None
+        occupiedMask &= ~(1 << cellIndex(old))
+        if hierarchyCluster != None:
+            repairHierarchy(old)
+    if C != None:
+        occupancy[cellIndex(C)] = u
+        occupiedMask |= 1 << cellIndex(C)
+        if hierarchyCluster != None:
+            repairHierarchy(C)
     location[u.index] = C
 
 # initStateVars: writeState
@@ -1108,6 +1855,7 @@ def getCtrl():
 # If c is a control state, setCtrl(c) sets ctrl to c.
 def setCtrl(c):
     global ctrl
+    stateChanged()
     ctrl = c
 
 # getTossWinner: readState -> player U {None}
@@ -1119,6 +1867,7 @@ def getTossWinner():
 # If p is a player, setTossWinner(p) sets tossWinner to p.
 def setTossWinner(p):
     global tossWinner
+    stateChanged()
     tossWinner = p
 
 # getFirstPlayer: readState -> player U {None}
@@ -1130,6 +1879,7 @@ def getFirstPlayer():
 # If p is a player, setFirstPlayer(p) sets firstPlayer to p.
 def setFirstPlayer(p):
     global firstPlayer
+    stateChanged()
     firstPlayer = p
 
 # getSecondPlayer: readState -> player U {None}
@@ -1141,6 +1891,7 @@ def getSecondPlayer():
 # If p is a player, setSecondPlayer(p) sets secondPlayer to p.
 def setSecondPlayer(p):
     global secondPlayer
+    stateChanged()
     secondPlayer = p
 
 # getActed: readState -> set(int)
@@ -1152,6 +1903,7 @@ def getActed():
 # If a is a set of integers, setActed(a) sets acted to a.
 def setActed(a):
     global acted
+    stateChanged()
     acted = a
 
 # initActions: writeState
@@ -1178,11 +1930,38 @@ def setActionQueue(Q):
     global actionQueue
     actionQueue = Q
 
+# initLineTable: writeState
+# initLineTable() initializes lineTable, a dict mapping each difference d
+# between two cells to offsetTrail(d).
+# If mapDimensions() is (10,10), every such difference is added up front.
+# Otherwise lineTable starts out empty, to be filled in by lineOfAttackTrail
+# as differences are asked for.
+def initLineTable():
+    global lineTable
+    lineTable = dict()
+    if mapDimensions() != (10,10):
+        return
+    (columns, rows) = mapDimensions()
+    for x in range(1 - columns, columns):
+        for y in range(1 - rows, rows):
+            lineTable[(x,y)] = offsetTrail((x,y))
+
+# initDistances: writeState
+# initDistances() initializes distMatrices, which holds cellDistMatrix() and
+# lineDistMatrix() once they are built, to an empty dict.
+def initDistances():
+    global distMatrices
+    distMatrices = dict()
+
 # initInterface: writeState
-# initInterface() initializes global variable selected to None
+# initInterface() initializes global variable selected to None, and
+# staticLayers, which holds the surfaces drawn by staticLayer(), to an empty
+# dict.
 def initInterface():
     global selected
+    global staticLayers
     selected = None
+    staticLayers = dict()
 
 # unitSelected: readState -> player U {None}
 # unitSelected() returns selected.
@@ -1193,15 +1972,13 @@ def unitSelected():
 # If i is an integer, unitWithIndex(i) is a member of roster with i as an
 # index, or None if no such member exists.
 def unitWithIndex(i):
-    for u in getRoster():
-        if u.index == i:
-            return u
-    return None
+    return units.get(i)
 
 # selectUnit: Unit * {None} -> writeState
 # If U is a unit or None, selectUnit(U) sets selected to U.
 def selectUnit(U):
     global selected
+    stateChanged()
     selected = U
 
 # movement: Unit -> R
@@ -1255,19 +2032,27 @@ def damage(U):
 # display: readState -> list(image)
 # display is a list including the following, added in the order they are
 # listed:
-#   The game background and the map grid
+#   The game background and the map grid, as the file image from
+#       staticLayer()
 #   The sprites for all units on the board
+#   The target markers from targetImages()
 #   The image for button 1 if ctrl is "callToss" or "selectFirst".
 #   The image for button 2 if ctrl is not a pair with first coordinate "deploy".
 #   The game's status message.
 #   No other elements.
+# The list is kept in displayCache and returned again, without rebuilding
+# it, until stateVersion changes. Callers must not change the list.
 def display():
-    base = background() + mapGrid() + allUnitImages()
+    global displayCache
+    if displayCache != None and displayCache[0] == stateVersion:
+        return displayCache[1]
+    base = staticLayer() + allUnitImages() + targetImages()
     if getCtrl() in {"callToss", "selectFirst"}:
         base += button1Image()
     if getCtrl()[0] != "deploy":
         base += button2Image()
     base += statusMessage()
+    displayCache = (stateVersion, base)
     return base
 
 # background: List(image)
@@ -1277,6 +2062,22 @@ def background():
     d = windowDimensions()
     return frect(Rectangle(-d[0]/2, d[1]/2, d[0], d[1]), bgColor())
 
+# staticLayer: readState -> list(image)
+# staticLayer() is a list whose only member is a file image covering the
+# whole window, showing background() and mapGrid() drawn onto a surface the
+# size of windowDimensions(), in the window's pixel format if it is open.
+# The surface is drawn the first time it is needed for each pair of window
+# and map dimensions and kept in staticLayers, so that each frame blits it
+# in one call instead of drawing the background and every grid line again.
+def staticLayer():
+    d = windowDimensions()
+    key = (d, mapDimensions())
+    if not key in staticLayers:
+        layer = displayFormat(Surface(d), False)
+        drawImages(layer, background() + mapGrid())
+        staticLayers[key] = layer
+    return [fileImg(staticLayers[key], (-d[0]/2, d[1]/2))]
+
 # statusMessage: List(image)
 # statusMessage() is a list whose only member is a black, 35-pt text image,
 # centered at (0,-300), such that the following is true:
@@ -1310,19 +2111,10 @@ def statusMessage():
     return [txt(msg, (0,windowDimensions()[1]/-2.222), int(windowDimensions()[0]/22.857), blackColor())]
 
 # frect: Rectangle * color -> list(image)
-# If R is a Rectangle and C is a color, then frect(R,C)
-# is a list of two filled triangles of color C, the first of which
-# has its corners at the top left, top right, and bottom left corners of R,
-# and the second of which has its corners at the top right, bottom right, and
-# bottom left corners of R.
+# If R is a Rectangle and C is a color, then frect(R,C) is a list whose only
+# member is a filled rectangle image of color C covering R.
 def frect(R,C):
-    tl = (R.left, R.top)
-    bl = (R.left, R.top - R.height)
-    tr = (R.left + R.width, R.top)
-    br = (R.left + R.width, R.top - R.height)
-    tri1 = ftri(tl, tr, bl, C)
-    tri2 = ftri(tr, br, bl, C)
-    return [tri1, tri2]
+    return [rect((R.left, R.top), R.width, R.height, C)]
 
 # mapGrid: list(image)
 # mapGrid() is a list of images depicting gridColor() colored line segments
@@ -1336,9 +2128,10 @@ def mapGrid():
     return out
 
 # mapHorizSeg: int -> list(image)
-# if i is an integer in {0..9}, then mapHorizSeg(i) is a list of images
+# if i is an integer in {0..n-1}, then mapHorizSeg(i) is a list of images
 # depicting gridColor() colored lines running along the upper and lower edges
-# of all cells of the form (x, 10-i), where x is an integer in {1..10}.
+# of all cells of the form (x, n-i), where x is an integer in {1..n} and
+# (n,n) is mapDimensions().
 def mapHorizSeg(i):
     columns = mapDimensions()[0]
     rows = mapDimensions()[1]
@@ -1353,9 +2146,10 @@ def mapHorizSeg(i):
     return [seg(p1, p2, gridColor()), seg(p3, p4, gridColor())]
 
 # mapVertSeg: int -> list(image)
-# if i is an integer in {0..9}, then mapVertSeg(i) is a list of images
+# if i is an integer in {0..n-1}, then mapVertSeg(i) is a list of images
 # depicting gridColor() colored lines running along the left and right edges
-# of all cells of the form (i+1, y), where y is an integer in {1..10}.
+# of all cells of the form (i+1, y), where y is an integer in {1..n} and
+# (n,n) is mapDimensions().
 def mapVertSeg(i):
     columns = mapDimensions()[0]
     rows = mapDimensions()[1]
@@ -1403,11 +2197,11 @@ def swordsmanImage(u):
     Cell = unitLocation(u)
     p = topLeft(Cell)
     if u.index in getActed():
-        return [fileImg(Swordsman_Done_Img, p)]
+        return [fileImg(sprite("Swordsman_Done.png"), p)]
     elif u == unitSelected():
-        return [fileImg(Swordsman_Selected_Img, p)]
+        return [fileImg(sprite("Swordsman_Selected.png"), p)]
     else:
-        return [fileImg(Swordsman_Img, p)]
+        return [fileImg(sprite("Swordsman.png"), p)]
     # return xImage(Cell, color)
 
 # xImage: cell * color -> list(image)
@@ -1435,13 +2229,26 @@ def slingerImage(u):
     Cell = unitLocation(u)
     p = topLeft(Cell)
     if u.index in getActed():
-        return [fileImg(Slinger_Done_Img, p)]
+        return [fileImg(sprite("Slinger_Done.png"), p)]
     elif u == unitSelected():
-        return [fileImg(Slinger_Selected_Img, p)]
+        return [fileImg(sprite("Slinger_Selected.png"), p)]
     else:
-        return [fileImg(Slinger_Img, p)]
+        return [fileImg(sprite("Slinger.png"), p)]
     # return [circ(cellCenter(Cell), int(cellWidth()/2), color)]
 
+# targetImages: readState -> list(image)
+# If ctrl is a pair with first coordinate "attack" and a unit u is selected,
+# targetImages() is a list of green() circles with a radius of half the cell
+# width (rounded down, but at least 1, as cells are under 2 pixels wide on
+# the largest maps), one centered in the cell of each unit in attackTargets(u).
+# Otherwise, targetImages() is an empty list.
+def targetImages():
+    u = unitSelected()
+    if u == None or getCtrl()[0] != "attack":
+        return []
+    r = max(1, int(cellWidth()/2))
+    return [circ(cellCenter(unitLocation(v)), r, green()) for v in attackTargets(u)]
+
 # bottomLeft: cell -> point
 # If c is a cell, bottomLeft(c) is the bottom-left corner of c.
 def bottomLeft(c):
@@ -1626,16 +2433,19 @@ def connectDB():
 '''Sounds'''
 #===========
 
-Slinger_Acknowledgement = loadSoundFile("Slinger_Select.wav")
-Slinger_Move = loadSoundFile("Slinger_Move.wav")
-Slinger_Attack = loadSoundFile("Slinger_Attack.wav")
-Slinger_Die = loadSoundFile("Slinger_Die.wav")
+# Each sound is a soundFile, which decodes its file the first time it is
+# played (or when preload runs), not when this file is loaded.
+
+Slinger_Acknowledgement = soundFile("Slinger_Select.wav")
+Slinger_Move = soundFile("Slinger_Move.wav")
+Slinger_Attack = soundFile("Slinger_Attack.wav")
+Slinger_Die = soundFile("Slinger_Die.wav")
 Slinger_Move_Music = "Slinger_Move_Music.wav"
 Slinger_Attack_Music = "Slinger_Attack_Music.wav"
-Swordsman_Acknowledgement = loadSoundFile("Swordsman_Select.wav")
-Swordsman_Move = loadSoundFile("Swordsman_Move.wav")
-Swordsman_Attack = loadSoundFile("Swordsman_Attack.wav")
-Swordsman_Die = loadSoundFile("Swordsman_Die.wav")
+Swordsman_Acknowledgement = soundFile("Swordsman_Select.wav")
+Swordsman_Move = soundFile("Swordsman_Move.wav")
+Swordsman_Attack = soundFile("Swordsman_Attack.wav")
+Swordsman_Die = soundFile("Swordsman_Die.wav")
 Swordsman_Move_Music = "Swordsman_Music.wav"
 Swordsman_Attack_Music = "Swordsman_Music.wav"
 
@@ -1661,15 +2471,43 @@ Swordsman_Attack_Music = "Swordsman_Music.wav"
 #===========
 '''Images'''
 #===========
-Slinger_Img = loadImageFile("Slinger.png")
-Slinger_Img = scale(Slinger_Img, (int(cellWidth()), int(cellWidth())))
-Slinger_Selected_Img = loadImageFile("Slinger_Selected.png")
-Slinger_Selected_Img = scale(Slinger_Selected_Img, (int(cellWidth()), int(cellWidth())))
-Slinger_Done_Img = loadImageFile("Slinger_Done.png")
-Slinger_Done_Img = scale(Slinger_Done_Img, (int(cellWidth()), int(cellWidth())))
-Swordsman_Img = loadImageFile("Swordsman.png")
-Swordsman_Img = scale(Swordsman_Img, (int(cellWidth()), int(cellWidth())))
-Swordsman_Selected_Img = loadImageFile("Swordsman_Selected.png")
-Swordsman_Selected_Img = scale(Swordsman_Selected_Img, (int(cellWidth()), int(cellWidth())))
-Swordsman_Done_Img = loadImageFile("Swordsman_Done.png")
-Swordsman_Done_Img = scale(Swordsman_Done_Img, (int(cellWidth()), int(cellWidth())))
+
+# scaleSprites: writeState
+# scaleSprites() sets spriteSize to (w, w), where w is cellWidth() rounded
+# down (or 1, if cellWidth() is less than 1), and calls stateChanged() so that
+# display() draws the sprites at the new size. The sprites are loaded at that
+# size the first time they are drawn, or when preload runs.
+def scaleSprites():
+    global spriteSize
+    w = max(1, int(cellWidth()))
+    spriteSize = (w, w)
+    stateChanged()
+
+# sprite: string -> surface
+# If name is the name of a unit sprite image file in the media directory,
+# sprite(name) is that image scaled to spriteSize.
+# loadScaledImage loads each file once and scales it once for each size, so
+# changing the map mode back and forth never decodes a file again. Once
+# Easel has opened the window, the images are in its pixel format.
+def sprite(name):
+    return loadScaledImage(name, spriteSize)
+
+# preload: -> None
+# preload() reads each of the unit sprite image files and decodes each of the
+# sounds, so that the first frame to draw a unit, or the first action to play
+# a sound, doesn't wait on the disk. Easel runs it on a background thread
+# once the first frame is shown, so it only reads the sprites (readImageFile):
+# converting and scaling them is left to sprite(), on the thread that draws.
+def preload():
+    for unit in ["Slinger", "Swordsman"]:
+        for state in ["", "_Selected", "_Done"]:
+            readImageFile(unit + state + ".png")
+    for s in [Slinger_Acknowledgement, Slinger_Move, Slinger_Attack,
+              Slinger_Die, Swordsman_Acknowledgement, Swordsman_Move,
+              Swordsman_Attack, Swordsman_Die]:
+        s.load()
+
+initDisplayCache()
+setMapMode(10, 3)
+setHierarchy(None)
+setInput(UserInput())
@@ -0,0 +1,1002 @@
+import os
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import sys
+import tracemalloc
+import threading
+from time import perf_counter, process_time, sleep
+from random import Random
+import pygame
+import maegen
+import EaselLib
+from EaselLib import drawImages, drawImage, drawImageList, drawDirtyImages, lastFramePixels, textCacheStats, setStrictDrawing
+
+'''
+MAEGEN BENCHMARKS:
+
+Timing comparisons for the performance work done on maegen and EaselLib.
+Run "python3 maegenBench.py" to run every benchmark, or
+"python3 maegenBench.py aStar" to run only benchAStar (and so on).
+
+Benchmarks run headless: the SDL audio and video drivers default to
+"dummy" unless they are already set in the environment.
+'''
+
+
+#==============
+'''Helpers'''
+#==============
+
+# timeIt: (-> a) * int -> R
+# If f is a function of no arguments and n is a positive integer, timeIt(f,n)
+# calls f n times and is the mean number of seconds taken per call.
+def timeIt(f, n):
+    start = perf_counter()
+    for i in range(n):
+        f()
+    return (perf_counter() - start) / n
+
+# allocated: (-> a) -> int
+# If f is a function of no arguments, allocated(f) calls f once and is the
+# peak number of bytes f had allocated at once.
+def allocated(f):
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    f()
+    peak = tracemalloc.get_traced_memory()[1] - start
+    tracemalloc.stop()
+    return peak
+
+# report: string * R * R -> writeState
+# report(name, old, new) prints the per-call times old and new, in
+# microseconds, and the speedup of new over old.
+def report(name, old, new):
+    print("%-40s %12.1f us %12.1f us %8.1fx" % (name, old * 1e6, new * 1e6, old / new))
+
+# crowdBoard: list(cell) -> writeState
+# crowdBoard(cells) reinitializes the game and places one extra swordsman on
+# each of the cells in cells, so that benchmarks can be run on a board more
+# crowded than the six-unit roster allows.
+def crowdBoard(cells):
+    maegen.init()
+    i = max(u.index for u in maegen.getRoster())
+    for C in cells:
+        i += 1
+        u = maegen.Swordsman(i)
+        maegen.addUnit(u)
+        maegen.setLocation(u, C)
+
+# screen: surface
+# screen() initializes pygame and is an offscreen surface the size of the
+# game window, for rendering benchmarks.
+def screen():
+    pygame.init()
+    return pygame.Surface(maegen.windowDimensions())
+
+# deployAll: int -> writeState
+# deployAll(seed) reinitializes the game and places every unit in the roster
+# on a distinct random cell chosen from the given seed, other than the
+# bottom-left and top-right corners.
+def deployAll(seed):
+    maegen.init()
+    (n, m) = maegen.mapDimensions()
+    cells = maegen.allCells()
+    cells.remove((1,1))
+    cells.remove((n,m))
+    chosen = Random(seed).sample(cells, len(maegen.getRoster()))
+    for (u, C) in zip(sorted(maegen.getRoster(), key=lambda u: u.index), chosen):
+        maegen.setLocation(u, C)
+
+# randomCells: int * int -> list(cell)
+# randomCells(n, seed) is a list of n distinct cells of the 10*10 board, other
+# than (1,1) and (10,10), chosen at random from the given seed.
+def randomCells(n, seed):
+    cells = [(x,y) for x in range(1,11) for y in range(1,11)]
+    cells.remove((1,1))
+    cells.remove((10,10))
+    return Random(seed).sample(cells, n)
+
+# rosterOccupied: cell * readState -> bool
+# rosterOccupied(A) is the original implementation of maegen.occupied(A),
+# which scans the whole roster.
+def rosterOccupied(A):
+    for u in maegen.getRoster():
+        if maegen.unitLocation(u) == A:
+            return True
+    return False
+
+# loopCellDist: cell * cell -> R
+# loopCellDist(C1,C2) is the original implementation of maegen.cellDist.
+def loopCellDist(C1, C2):
+    xMax = max({C1[0], C2[0]})
+    yMax = max({C1[1], C2[1]})
+    xMin = min({C1[0], C2[0]})
+    yMin = min({C1[1], C2[1]})
+    count = 0.0
+    while (xMax != xMin and yMax != yMin):
+        xMax -= 1
+        yMax -= 1
+        count += 1.5
+    count += (xMax - xMin) + (yMax - yMin)
+    return count
+
+# immediateDisplay: readState -> list(image)
+# immediateDisplay() is maegen.display() as it was before staticLayer(), with
+# the background and every grid line drawn as separate images.
+def immediateDisplay():
+    base = maegen.background() + maegen.mapGrid() + maegen.allUnitImages() + maegen.targetImages()
+    if maegen.getCtrl() in {"callToss", "selectFirst"}:
+        base += maegen.button1Image()
+    if maegen.getCtrl()[0] != "deploy":
+        base += maegen.button2Image()
+    base += maegen.statusMessage()
+    return base
+
+# uncachedText: surface * txt -> writeState
+# uncachedText(S,x) draws the text image x onto S as txt.draw did before the
+# font and text caches, loading the font and rendering the text every time.
+def uncachedText(S, x):
+    W,H = S.get_size()
+    text = pygame.font.Font(None, x.height).render(x.text, 1, x.color)
+    S.blit(text, text.get_rect(centerx=int(W/2+x.center[0]), centery=int(H/2-x.center[1])))
+
+# triangleRect: Rectangle * color -> list(image)
+# triangleRect(R,C) is the original implementation of maegen.frect, a pair
+# of filled triangles covering R.
+def triangleRect(R, C):
+    tl = (R.left, R.top)
+    bl = (R.left, R.top - R.height)
+    tr = (R.left + R.width, R.top)
+    br = (R.left + R.width, R.top - R.height)
+    return [maegen.ftri(tl, tr, bl, C), maegen.ftri(tr, br, bl, C)]
+
+# freshDisplay: readState -> list(image)
+# freshDisplay() is maegen.display() built from scratch: it marks the game
+# state as changed first, so that the list display() memoized is not reused.
+def freshDisplay():
+    maegen.stateChanged()
+    return maegen.display()
+
+# setClearLineOfAttack: cell * cell * readState -> bool
+# setClearLineOfAttack(l1,l2) is the original implementation of
+# maegen.clearLineOfAttack(l1,l2), which builds lineOfAttackSet(l1,l2) and
+# checks each of its cells.
+def setClearLineOfAttack(l1, l2):
+    trail = maegen.lineOfAttackSet(l1,l2).difference({l1,l2})
+    return maegen.allUnoccupied(trail)
+
+# mazeCells: int * int -> list(cell)
+# mazeCells(n, step) is a list of cells forming walls across an n * n map,
+# every step columns, with gaps at alternating ends, so that paths from the
+# left of the map to the right have to snake through every wall.
+def mazeCells(n, step):
+    out = []
+    for (j, x) in enumerate(range(step, n, step)):
+        if j % 2 == 0:
+            out += [(x,y) for y in range(1, n - 3)]
+        else:
+            out += [(x,y) for y in range(5, n + 1)]
+    return out
+
+# wallCells: list(cell)
+# wallCells() is a list of cells forming two staggered walls across the 10*10
+# board, forcing paths from one side to the other to wind around them.
+def wallCells():
+    return [(4,y) for y in range(1,9)] + [(7,y) for y in range(3,11)]
+
+
+#=================
+'''Benchmarks'''
+#=================
+
+# benchAStar: writeState
+# benchAStar() times aStar against listAStar on an open board and on a board
+# crowded by wallCells(), checking that both return the same costs.
+# (The walled queries only cross one wall: listAStar takes minutes to find a
+# path through both.)
+def benchAStar():
+    print("%-40s %15s %15s %9s" % ("aStar", "listAStar", "aStar", "speedup"))
+    openQueries = [((1,1),(10,10)), ((1,10),(10,1)), ((2,5),(9,5)), ((5,1),(5,10))]
+    wallQueries = [((1,1),(3,8)), ((2,5),(5,9)), ((1,1),(6,10))]
+    for (name, cells, queries) in [("open board", [], openQueries),
+                                   ("walled board", wallCells(), wallQueries)]:
+        crowdBoard(cells)
+        for (a,b) in queries:
+            assert maegen.aStar(a,b)[2] == maegen.listAStar(a,b)[2]
+        old = timeIt(lambda: [maegen.listAStar(a,b) for (a,b) in queries], 3)
+        new = timeIt(lambda: [maegen.aStar(a,b) for (a,b) in queries], 20)
+        report(name, old / len(queries), new / len(queries))
+
+# benchOccupancy: writeState
+# benchOccupancy() times aStar((1,1),(10,10)) with occupied scanning the roster
+# and with occupied reading the occupancy index, for growing numbers of
+# units on the board.
+def benchOccupancy():
+    print("%-40s %15s %15s %9s" % ("aStar by units on board", "roster scan", "occupancy", "speedup"))
+    for n in [0, 10, 20, 40, 60]:
+        crowdBoard(randomCells(n, n))
+        indexed = maegen.occupied
+        try:
+            maegen.occupied = rosterOccupied
+            old = timeIt(lambda: maegen.aStar((1,1),(10,10)), 20)
+            expected = maegen.aStar((1,1),(10,10))[2]
+        finally:
+            maegen.occupied = indexed
+        new = timeIt(lambda: maegen.aStar((1,1),(10,10)), 20)
+        assert maegen.aStar((1,1),(10,10))[2] == expected
+        report("%d units" % len(maegen.getRoster()), old, new)
+
+# benchReach: writeState
+# benchReach() times reachableCells(u) for a slinger u in the middle of a
+# crowded board against asking moveCost for every cell on the board, and
+# checks that both agree on which cells u can reach.
+def benchReach():
+    print("%-40s %15s %15s %9s" % ("reachable cells", "moveCost x 100", "reachable", "speedup"))
+    crowdBoard(randomCells(20, 3))
+    u = maegen.unitWithIndex(1)
+    maegen.setLocation(u, (5,5))
+    cells = [(x,y) for x in range(1,11) for y in range(1,11)]
+    def byMoveCost():
+        maegen.pathCache.clear()
+        out = dict()
+        for B in cells:
+            cost = maegen.moveCost((5,5), B)
+            if B != (5,5) and cost <= maegen.movement(u):
+                out[B] = cost
+        return out
+    def byReach():
+        maegen.setLocation(u, (5,5))
+        return maegen.reachableCells(u)
+    assert byMoveCost() == byReach()
+    report("slinger at (5,5), 25 units", timeIt(byMoveCost, 5), timeIt(byReach, 50))
+    report("cached", timeIt(byMoveCost, 5), timeIt(lambda: maegen.reachableCells(u), 1000))
+
+# benchPathCache: writeState
+# benchPathCache() plays out a move phase on a crowded board: each placed
+# unit in turn is asked moveCost to every cell five times over, as a tool or
+# AI player weighing its moves might (the game's own Move.reqs asks
+# reachableCells instead; see benchReach), and then moves. It times this with
+# cachedPath against calling aStar directly, checks that both give the same
+# costs, and reports the hit and miss counts of pathCache.
+def benchPathCache():
+    print("%-40s %15s %15s %9s" % ("path cache", "aStar", "cachedPath", "speedup"))
+    cells = [(x,y) for x in range(1,11) for y in range(1,11)]
+    def phase(cost):
+        crowdBoard(randomCells(20, 5))
+        out = []
+        placed = [u for u in maegen.getRoster() if maegen.unitLocation(u) != None]
+        for u in sorted(placed, key=lambda u: u.index):
+            A = maegen.unitLocation(u)
+            for click in range(5):
+                out.append([cost(A, B) for B in cells])
+            free = [B for B in cells if not maegen.occupied(B)]
+            maegen.setLocation(u, free[len(out) % len(free)])
+        return out
+    def direct(A, B):
+        c = maegen.aStar(A, B)[2]
+        return c if c != -1 else 9000.1
+    assert phase(direct) == phase(maegen.moveCost)
+    old = timeIt(lambda: phase(direct), 2)
+    new = timeIt(lambda: phase(maegen.moveCost), 2)
+    report("20 units, 5 passes each", old, new)
+    (hits, misses) = maegen.pathCacheStats()
+    print("%-40s %15d %15d %8.0f%%" % ("hits, misses, hit rate", hits, misses, 100.0 * hits / (hits + misses)))
+
+# benchLineOfAttack: writeState
+# benchLineOfAttack() checks clearLineOfAttack against setClearLineOfAttack
+# for every pair of cells on a crowded board, then times both over all pairs.
+def benchLineOfAttack():
+    print("%-40s %15s %15s %9s" % ("clearLineOfAttack", "sets", "lineTable", "speedup"))
+    start = perf_counter()
+    crowdBoard(randomCells(20, 4))
+    print("%-40s %12.1f ms" % ("init() with lineTable", (perf_counter() - start) * 1e3))
+    pairs = [(l1,l2) for l1 in maegen.allCells() for l2 in maegen.allCells()]
+    for (l1,l2) in pairs:
+        assert maegen.clearLineOfAttack(l1,l2) == setClearLineOfAttack(l1,l2)
+    old = timeIt(lambda: [setClearLineOfAttack(l1,l2) for (l1,l2) in pairs], 1)
+    new = timeIt(lambda: [maegen.clearLineOfAttack(l1,l2) for (l1,l2) in pairs], 5)
+    report("per pair, 26 units", old / len(pairs), new / len(pairs))
+
+# benchAttackTargets: writeState
+# benchAttackTargets() times attackTargets(u) against checking Attack.reqs
+# for u against every enemy, and checks that both find the same targets.
+# It is run with the usual armies of three on a crowded board, and with
+# armies of 30 on an otherwise empty board.
+def benchAttackTargets():
+    print("%-40s %15s %15s %9s" % ("attack targets", "Attack.reqs", "attackTargets", "speedup"))
+    for (k, crowd) in [(3, 20), (30, 0)]:
+        try:
+            maegen.setMapMode(10, k)
+            crowdBoard(randomCells(crowd, 5))
+            cells = [C for C in maegen.allCells() if not maegen.occupied(C)]
+            for (i, C) in enumerate(Random(k).sample(cells, 2 * k)):
+                maegen.setLocation(maegen.unitWithIndex(i + 1), C)
+            maegen.setCtrl(("attack", "red"))
+            maegen.setActed(set())
+            u = maegen.unitWithIndex(1)
+            enemies = [maegen.unitWithIndex(i) for i in maegen.army("black")]
+            def byReqs():
+                return [v for v in enemies if maegen.Attack("red", u, v).reqs()]
+            assert set(byReqs()) == set(maegen.attackTargets(u))
+            name = "slinger, %d enemies, %d units" % (len(enemies), len(maegen.getRoster()))
+            report(name, timeIt(byReqs, 200), timeIt(lambda: maegen.attackTargets(u), 200))
+        finally:
+            maegen.setMapMode(10, 3)
+
+# benchLargeMap: writeState
+# benchLargeMap() times init(), aStar from corner to corner, reachableCells
+# for a slinger, and rendering a frame, on 10 * 10, 64 * 64 and 256 * 256
+# maps with every unit deployed.
+def benchLargeMap():
+    print("%-20s %10s %10s %10s %10s %10s" % ("map, units", "init", "aStar", "reachable", "display", "draw"))
+    S = screen()
+    for (n, k, runs) in [(10, 3, 50), (64, 200, 10), (256, 500, 2)]:
+        try:
+            maegen.setMapMode(n, k)
+            start = perf_counter()
+            deployAll(n)
+            tInit = perf_counter() - start
+            u = maegen.unitWithIndex(1)
+            def reach():
+                maegen.setLocation(u, maegen.unitLocation(u))
+                return maegen.reachableCells(u)
+            tPath = timeIt(lambda: maegen.aStar((1,1),(n,n)), runs)
+            tReach = timeIt(reach, runs)
+            tDisplay = timeIt(freshDisplay, runs)
+            images = maegen.display()
+            tDraw = timeIt(lambda: drawImages(S, images), runs)
+            name = "%d*%d, %d" % (n, n, 2 * k)
+            print("%-20s %7.1f ms %7.1f ms %7.1f ms %7.1f ms %7.1f ms" % (name, tInit * 1e3,
+                tPath * 1e3, tReach * 1e3, tDisplay * 1e3, tDraw * 1e3))
+        finally:
+            maegen.setMapMode(10, 3)
+
+# benchHierarchy: writeState
+# benchHierarchy() times aStar against hierarchySearch (the search moveCost,
+# which only tools and AI players call, uses when setHierarchy is on) from the left edge to the right edge of
+# 128 * 128 and 256 * 256 mazes, with 16 * 16 clusters. hierarchySearch is
+# timed cold (no cluster tables yet), warm, and after a unit has been moved
+# in and out of a wall, and hpaStar (which also refines the path) is timed
+# warm. All four must find the same costs.
+def benchHierarchy():
+    print("%-20s %10s %10s %10s %10s %10s" % ("maze, clusters", "aStar", "cold", "warm", "repaired", "hpaStar"))
+    for (n, step) in [(128, 8), (256, 16)]:
+        try:
+            maegen.setMapMode(n, 3)
+            maegen.setHierarchy(16)
+            crowdBoard(mazeCells(n, step))
+            R = Random(n)
+            queries = [((1, R.randint(1,n)), (n, R.randint(1,n))) for i in range(3)]
+            expected = [maegen.aStar(a,b)[2] for (a,b) in queries]
+            def search():
+                assert [maegen.hierarchySearch(a,b)[2] for (a,b) in queries] == expected
+            tAStar = timeIt(lambda: [maegen.aStar(a,b) for (a,b) in queries], 1)
+            tCold = timeIt(search, 1)
+            tWarm = timeIt(search, 1)
+            u = maegen.unitWithIndex(7)
+            C = maegen.unitLocation(u)
+            maegen.setLocation(u, (1,1))
+            maegen.setLocation(u, C)
+            tRepaired = timeIt(search, 1)
+            assert [maegen.hpaStar(a,b)[2] for (a,b) in queries] == expected
+            tRefined = timeIt(lambda: [maegen.hpaStar(a,b) for (a,b) in queries], 1)
+            name = "%d*%d, 16*16" % (n, n)
+            times = [t / len(queries) * 1e3 for t in [tAStar, tCold, tWarm, tRepaired, tRefined]]
+            print("%-20s %7.1f ms %7.1f ms %7.1f ms %7.1f ms %7.1f ms" % tuple([name] + times))
+        finally:
+            maegen.setHierarchy(None)
+            maegen.setMapMode(10, 3)
+
+# benchFlowField: writeState
+# benchFlowField() times routing every red unit towards a shared goal on a
+# 64 * 64 map, once by running aStar for each unit and once by building a
+# single flowField and reading each unit's cost and route from it with
+# flowMoves, and checks that both give the same costs.
+def benchFlowField():
+    print("%-40s %15s %15s %9s" % ("routing to a shared goal", "aStar each", "flowField", "speedup"))
+    for k in [25, 100, 400]:
+        try:
+            maegen.setMapMode(64, k)
+            deployAll(k)
+            G = (64,64)
+            red = [maegen.unitWithIndex(i) for i in sorted(maegen.army("red"))]
+            expected = [maegen.moveCost(maegen.unitLocation(u), G) for u in red]
+            assert [maegen.flowCost(maegen.unitLocation(u), G) for u in red] == expected
+            maegen.setCtrl(("move", "red"))
+            maegen.setActed(set())
+            def byFlow():
+                maegen.flowFields.clear()
+                return maegen.flowMoves("red", G)
+            old = timeIt(lambda: [maegen.aStar(maegen.unitLocation(u), G) for u in red], 1)
+            new = timeIt(byFlow, 3)
+            report("%d units, 64*64" % k, old, new)
+        finally:
+            maegen.setMapMode(10, 3)
+
+# benchCellDist: writeState
+# benchCellDist() checks cellDist, cellDistMatrix() and lineDistMatrix()
+# against loopCellDist and straightLineDistance for every pair of cells, then
+# times loopCellDist, cellDist and reading cellDistMatrix() one pair at a
+# time, and aStar on the walled board with loopCellDist and with cellDist.
+def benchCellDist():
+    print("%-40s %15s %15s %9s" % ("cellDist", "loop", "closed form", "speedup"))
+    maegen.init()
+    cells = maegen.allCells()
+    pairs = [(C1, C2) for C1 in cells for C2 in cells]
+    matrix = maegen.cellDistMatrix()
+    lines = maegen.lineDistMatrix()
+    for (C1, C2) in pairs:
+        (i, j) = (maegen.cellIndex(C1), maegen.cellIndex(C2))
+        assert maegen.cellDist(C1, C2) == loopCellDist(C1, C2) == matrix[i, j]
+        assert maegen.straightLineDistance(C1, C2) == lines[i, j]
+    old = timeIt(lambda: [loopCellDist(C1, C2) for (C1, C2) in pairs], 1) / len(pairs)
+    new = timeIt(lambda: [maegen.cellDist(C1, C2) for (C1, C2) in pairs], 3) / len(pairs)
+    report("per pair", old, new)
+    indexed = [(maegen.cellIndex(C1), maegen.cellIndex(C2)) for (C1, C2) in pairs]
+    lookup = timeIt(lambda: [matrix[i, j] for (i, j) in indexed], 3) / len(pairs)
+    report("per pair, cellDistMatrix()[i, j]", old, lookup)
+    row = timeIt(lambda: [matrix[i] for i in range(len(cells))], 3) / len(pairs)
+    report("per pair, whole rows of cellDistMatrix()", old, row)
+    crowdBoard(wallCells())
+    queries = [((1,1),(3,8)), ((2,5),(5,9)), ((1,1),(6,10)), ((1,1),(10,10))]
+    closedForm = maegen.cellDist
+    try:
+        maegen.cellDist = loopCellDist
+        old = timeIt(lambda: [maegen.aStar(a,b) for (a,b) in queries], 20)
+    finally:
+        maegen.cellDist = closedForm
+    new = timeIt(lambda: [maegen.aStar(a,b) for (a,b) in queries], 20)
+    report("aStar on the walled board", old / len(queries), new / len(queries))
+
+# benchFrame: writeState
+# benchFrame() times building and drawing a whole frame with
+# immediateDisplay() against display(), which blits staticLayer(), on
+# 10 * 10 and 64 * 64 maps with every unit deployed, and checks that both
+# draw the same pixels.
+def benchFrame():
+    print("%-40s %15s %15s %9s" % ("frame", "immediate", "static layer", "speedup"))
+    S = screen()
+    for (n, k, runs) in [(10, 3, 200), (64, 200, 20)]:
+        try:
+            maegen.setMapMode(n, k)
+            deployAll(n)
+            drawImages(S, immediateDisplay())
+            expected = pygame.image.tostring(S, "RGB")
+            drawImages(S, maegen.display())
+            assert pygame.image.tostring(S, "RGB") == expected
+            old = timeIt(lambda: drawImages(S, immediateDisplay()), runs)
+            new = timeIt(lambda: drawImages(S, freshDisplay()), runs)
+            report("%d * %d, %d units" % (n, n, 2 * k), old, new)
+        finally:
+            maegen.setMapMode(10, 3)
+
+# benchDirtyRects: writeState
+# benchDirtyRects() plays the first turns of a game, drawing each frame with
+# drawImages and with drawDirtyImages onto two offscreen surfaces, and checks
+# after every frame that both surfaces hold the same pixels. It then times
+# both on a frame where nothing changed and on one where a unit is selected,
+# and reports the pixels each pushed per frame over the whole game.
+def benchDirtyRects():
+    print("%-40s %15s %15s %9s" % ("dirty rectangles", "full", "dirty", "speedup"))
+    full = screen()
+    dirty = pygame.Surface(full.get_size())
+    pushed = {"full": [], "dirty": []}
+    def frame():
+        drawImages(full, maegen.display())
+        pushed["full"].append(lastFramePixels())
+        drawDirtyImages(dirty, maegen.display())
+        pushed["dirty"].append(lastFramePixels())
+        assert pygame.image.tostring(full, "RGB") == pygame.image.tostring(dirty, "RGB")
+    maegen.init()
+    maegen.playBackGroundMusic = lambda name: None
+    maegen.setInput(EaselLib.UserInput())
+    frame()
+    turns = [lambda: [maegen.CoinToss("head")],
+        lambda: [maegen.SelectFirstPlayer(maegen.getTossWinner(), "red")],
+        lambda: [maegen.Place("red", maegen.unitWithIndex(i), (i, 1)) for i in (1, 2, 3)],
+        lambda: [maegen.Place("black", maegen.unitWithIndex(i), (i - 3, 10)) for i in (4, 5, 6)]]
+    for turn in turns:
+        for A in turn():
+            maegen.queueAction(A)
+        for i in range(2):
+            maegen.update()
+            for j in range(5):
+                frame()
+    u = maegen.unitWithIndex(1)
+    maegen.selectUnit(u)
+    frame()
+    old = timeIt(lambda: drawImages(full, maegen.display()), 100)
+    new = timeIt(lambda: drawDirtyImages(dirty, maegen.display()), 100)
+    report("nothing changed", old, new)
+    def toggle():
+        maegen.selectUnit(None if maegen.unitSelected() == u else u)
+    old = timeIt(lambda: (toggle(), drawImages(full, maegen.display())), 100)
+    new = timeIt(lambda: (toggle(), drawDirtyImages(dirty, maegen.display())), 100)
+    report("unit selected or deselected", old, new)
+    for name in ["full", "dirty"]:
+        print("%-40s %12.0f px per frame" % (name + ", " + str(len(pushed[name])) + " frames",
+            sum(pushed[name]) / len(pushed[name])))
+
+# benchText: writeState
+# benchText() times drawing the text images of a frame (the status message
+# and both button captions) with uncachedText against txt.draw, and a whole
+# frame with drawImages, then prints textCacheStats().
+def benchText():
+    print("%-40s %15s %15s %9s" % ("text", "uncached", "cached", "speedup"))
+    S = screen()
+    maegen.init()
+    texts = [x for x in maegen.display() if x.category == "txt"]
+    old = timeIt(lambda: [uncachedText(S, x) for x in texts], 200)
+    new = timeIt(lambda: [x.draw(S) for x in texts], 200)
+    report("%d captions" % len(texts), old, new)
+    def uncachedFrame():
+        S.fill((255,255,255))
+        for x in maegen.display():
+            if x.category == "txt":
+                uncachedText(S, x)
+            else:
+                x.draw(S)
+    old = timeIt(uncachedFrame, 200)
+    new = timeIt(lambda: drawImages(S, freshDisplay()), 200)
+    report("whole frame", old, new)
+    print("%-40s %s" % ("textCacheStats()", textCacheStats()))
+
+# benchValidation: writeState
+# benchValidation() times building and drawing a frame with strict drawing,
+# where drawImage calls isDrawable on every image, against the default
+# trusted path, where it reads the valid attribute each image set when it
+# was made, on 10 * 10 and 64 * 64 maps with every unit deployed. It also
+# reports the peak bytes each allocates while drawing a frame.
+def benchValidation():
+    print("%-40s %15s %15s %9s" % ("validation", "strict", "trusted", "speedup"))
+    S = screen()
+    for (n, k, runs) in [(10, 3, 500), (64, 200, 50)]:
+        try:
+            maegen.setMapMode(n, k)
+            deployAll(n)
+            times = []
+            peaks = []
+            for strict in [True, False]:
+                setStrictDrawing(strict)
+                drawImages(S, maegen.display())
+                times.append(timeIt(lambda: drawImages(S, freshDisplay()), runs))
+                peaks.append(allocated(lambda: drawImages(S, maegen.display())))
+                images = maegen.display()
+                times.append(timeIt(lambda: drawImages(S, images), runs))
+            name = "%d * %d, %d units" % (n, n, 2 * k)
+            report(name + ", whole frame", times[0], times[2])
+            report(name + ", drawImages only", times[1], times[3])
+            print("%-40s %12d B  %12d B" % (name + ", peak bytes", peaks[0], peaks[1]))
+        finally:
+            setStrictDrawing(False)
+            maegen.setMapMode(10, 3)
+
+# benchRect: writeState
+# benchRect() checks that frect draws the same pixels as triangleRect for
+# the window background and both buttons. It then times drawing the
+# background and the buttons both ways, and with Surface.fill for
+# comparison, and a whole frame at the coin toss (which shows both buttons)
+# with the button rectangles drawn as triangles and as rects.
+def benchRect():
+    print("%-40s %15s %15s %9s" % ("filled rectangles", "triangles", "rect", "speedup"))
+    S = screen()
+    maegen.init()
+    d = maegen.windowDimensions()
+    areas = [maegen.Rectangle(-d[0]/2, d[1]/2, d[0], d[1]), maegen.button1Area(), maegen.button2Area()]
+    for R in areas:
+        S.fill((255,255,255))
+        for x in triangleRect(R, (10,20,30)):
+            x.draw(S)
+        expected = pygame.image.tostring(S, "RGB")
+        S.fill((255,255,255))
+        for x in maegen.frect(R, (10,20,30)):
+            x.draw(S)
+        assert pygame.image.tostring(S, "RGB") == expected
+    for (name, rs) in [("background", areas[:1]), ("buttons", areas[1:])]:
+        old = timeIt(lambda: [x.draw(S) for R in rs for x in triangleRect(R, (10,20,30))], 200)
+        new = timeIt(lambda: [x.draw(S) for R in rs for x in maegen.frect(R, (10,20,30))], 200)
+        report(name, old, new)
+        fill = timeIt(lambda: [S.fill((10,20,30), x.bounds(S)) for R in rs for x in maegen.frect(R, (10,20,30))], 200)
+        report(name + ", Surface.fill instead", old, fill)
+    rects = maegen.frect
+    try:
+        maegen.frect = triangleRect
+        old = timeIt(lambda: drawImages(S, freshDisplay()), 200)
+    finally:
+        maegen.frect = rects
+    new = timeIt(lambda: drawImages(S, freshDisplay()), 200)
+    report("whole frame at the coin toss", old, new)
+
+# benchBlits: writeState
+# benchBlits() times drawing the images of a frame one at a time with
+# drawImage against drawImageList, which batches the unit sprites into
+# Surface.blits calls, on 10 * 10, 64 * 64 and 256 * 256 maps with every
+# unit deployed, and checks that both draw the same pixels.
+def benchBlits():
+    print("%-40s %15s %15s %9s" % ("sprite blits", "one at a time", "blits", "speedup"))
+    S = screen()
+    for (n, k, runs) in [(10, 3, 500), (64, 200, 100), (256, 500, 50)]:
+        try:
+            maegen.setMapMode(n, k)
+            deployAll(n)
+            images = maegen.display()
+            def single():
+                for x in images:
+                    drawImage(S, x)
+            single()
+            expected = pygame.image.tostring(S, "RGB")
+            drawImageList(S, images)
+            assert pygame.image.tostring(S, "RGB") == expected
+            report("%d * %d, %d units" % (n, n, 2 * k), timeIt(single, runs),
+                timeIt(lambda: drawImageList(S, images), runs))
+        finally:
+            maegen.setMapMode(10, 3)
+
+# benchSpriteFormat: writeState
+# benchSpriteFormat() opens a (headless) window and times blitting each unit
+# sprite onto it, as loaded and scaled from its file and after convertImages
+# has converted it to the window's pixel format, reporting blits per second.
+# It then times switching from a 10 * 10 to a 64 * 64 map and back, getting
+# every sprite at each size as the first frame drawn at that size would
+# (scaleSprites only sets the size; sprite() scales lazily), with the image
+# libraries emptied first (so every file is decoded again) and with them kept.
+def benchSpriteFormat():
+    print("%-40s %15s %15s %9s" % ("sprite format", "as loaded", "converted", "speedup"))
+    try:
+        S = pygame.display.set_mode(maegen.windowDimensions())
+        size = maegen.spriteSize
+        for name in ["Slinger.png", "Swordsman_Selected.png"]:
+            raw = pygame.transform.scale(pygame.image.load(os.path.join("media", name)), size)
+            EaselLib.convertImages()
+            converted = maegen.sprite(name)
+            assert converted.get_bitsize() == S.get_bitsize()
+            old = timeIt(lambda: S.blits([(raw, (i % 400, i % 600)) for i in range(1000)], False), 20) / 1000
+            new = timeIt(lambda: S.blits([(converted, (i % 400, i % 600)) for i in range(1000)], False), 20) / 1000
+            report(name, old, new)
+            print("%-40s %12.0f /s %12.0f /s" % ("", 1 / old, 1 / new))
+        def drawSprites():
+            for unit in ["Slinger", "Swordsman"]:
+                for state in ["", "_Selected", "_Done"]:
+                    maegen.sprite(unit + state + ".png")
+        def switch():
+            maegen.setMapMode(64, 3)
+            drawSprites()
+            maegen.setMapMode(10, 3)
+            drawSprites()
+        def reload():
+            EaselLib._image_library.clear()
+            EaselLib._scaled_library.clear()
+            switch()
+        switch()
+        report("setMapMode(64) and back", timeIt(reload, 20), timeIt(switch, 20))
+    finally:
+        maegen.setMapMode(10, 3)
+        pygame.display.quit()
+
+# benchDisplayCache: writeState
+# benchDisplayCache() plays the opening turns and a move, checking after
+# every update that display() shows the same images as a list built from
+# scratch. It then times an idle frame (display() and drawDirtyImages when
+# nothing has changed) with the list rebuilt every frame and with the
+# memoized list.
+def benchDisplayCache():
+    print("%-40s %15s %15s %9s" % ("display cache", "rebuilt", "memoized", "speedup"))
+    S = screen()
+    maegen.init()
+    maegen.playBackGroundMusic = lambda name: None
+    maegen.setInput(EaselLib.UserInput())
+    def check():
+        images = maegen.display()
+        assert [x.key() for x in images] == [x.key() for x in freshDisplay()]
+    turns = [lambda: [maegen.CoinToss("head")],
+        lambda: [maegen.SelectFirstPlayer(maegen.getTossWinner(), "red")],
+        lambda: [maegen.Place("red", maegen.unitWithIndex(i), (i, 1)) for i in (1, 2, 3)],
+        lambda: [maegen.Place("black", maegen.unitWithIndex(i), (i - 3, 10)) for i in (4, 5, 6)],
+        lambda: [maegen.Move("red", maegen.unitWithIndex(1), (3, 3))]]
+    check()
+    for turn in turns:
+        for A in turn():
+            maegen.queueAction(A)
+        for i in range(2):
+            maegen.update()
+            check()
+    maegen.selectUnit(maegen.unitWithIndex(2))
+    check()
+    drawDirtyImages(S, maegen.display())
+    old = timeIt(lambda: drawDirtyImages(S, freshDisplay()), 200)
+    new = timeIt(lambda: drawDirtyImages(S, maegen.display()), 200)
+    report("idle frame", old, new)
+
+# benchIdle: writeState
+# benchIdle() runs Easel.main on maegen, headless and with no input, for two
+# seconds at the coin toss, first with eventDriven() false (the loop runs at
+# the frame rate) and then true (the loop sleeps until input). It reports
+# the frames run and the CPU time used as a share of the wall time, counted
+# from the second frame on so that start-up is left out.
+def benchIdle():
+    import Easel
+    print("%-40s %15s %15s" % ("idle play, 2 s", "updates", "CPU"))
+    (driven, music) = (maegen.eventDriven, maegen.playBackGroundMusic)
+    (update, frames, start) = (maegen.update, [0], [0, 0])
+    def countedUpdate():
+        frames[0] += 1
+        if frames[0] == 1:
+            start[:] = [perf_counter(), process_time()]
+        update()
+    try:
+        maegen.playBackGroundMusic = lambda name: None
+        maegen.update = countedUpdate
+        for mode in [False, True]:
+            maegen.eventDriven = lambda: mode
+            frames[0] = 0
+            quit = threading.Timer(2.0, lambda: pygame.event.post(pygame.event.Event(pygame.QUIT)))
+            quit.start()
+            Easel.main(maegen)
+            (wall, cpu) = (perf_counter() - start[0], process_time() - start[1])
+            name = "eventDriven() " + str(mode)
+            print("%-40s %15d %14.1f%%" % (name, frames[0], 100 * cpu / wall))
+    finally:
+        (maegen.eventDriven, maegen.playBackGroundMusic) = (driven, music)
+        maegen.update = update
+
+# benchHeadless: writeState
+# benchHeadless() runs Easel.main on maegen with the headless backend for 300
+# frames at the coin toss, then for 20 frames capturing raw RGB frames, and
+# prints the frame rates main reports.
+def benchHeadless():
+    import Easel
+    print("%-40s %15s %15s" % ("headless Easel.main", "frames", "per second"))
+    music = maegen.playBackGroundMusic
+    try:
+        maegen.playBackGroundMusic = lambda name: None
+        stats = Easel.main(maegen, headless=True, frames=300)
+        print("%-40s %15d %15.1f" % ("no capture", stats["frames"], stats["fps"]))
+        frames = []
+        stats = Easel.main(maegen, headless=True, frames=20, capture=frames)
+        assert len(frames) == 20
+        print("%-40s %15d %15.1f" % ("raw RGB capture", stats["frames"], stats["fps"]))
+    finally:
+        maegen.playBackGroundMusic = music
+
+# benchHooks: writeState
+# benchHooks() times the per-frame work Easel.main does to find maegen's
+# hooks and hand it input: three "in dir(G)" searches and seven input
+# globals written onto the module, against a GameAdapter made once, whose
+# hooks are attributes and whose input maegen reads through setInput.
+# The old way runs on a throwaway copy of maegen's namespace, so that the
+# globals it writes never touch maegen itself.
+def benchHooks():
+    import Easel, types
+    print("%-40s %15s %15s %9s" % ("game hooks", "dir(G)", "adapter", "speedup"))
+    G = Easel.GameAdapter(maegen)
+    copy = types.ModuleType("maegenCopy")
+    copy.__dict__.update(vars(maegen))
+    def old():
+        found = ("display" in dir(copy), "sounds" in dir(copy), "update" in dir(copy))
+        (copy.mouseX, copy.mouseY, copy.mouseDown, copy.oldMouseDown) = (0, 0, False, False)
+        (copy.keysDown, copy.oldKeysDown, copy.keysPressed) = ([], [], [])
+        return found
+    def new():
+        G.sendInput()
+        return (G.hasDisplay, G.sounds, G.update)
+    report("per frame", timeIt(old, 2000), timeIt(new, 2000))
+
+# benchKeys: writeState
+# benchKeys() times reading the keyboard for one frame the way Easel.main
+# used to (a list comprehension calling pygame.key.get_pressed() twice per
+# key, then pygame.key.set_repeat) against one snapshot taken with
+# UserInput.setKeys, followed by isDown and wasPressed for five keys, and by
+# building the keysDown view. It then times the same snapshot handed to a
+# game without setInput through GameAdapter.sendInput, which gives it key
+# views, followed by "k in keysDown" for the five keys.
+def benchKeys():
+    import Easel, types
+    print("%-40s %15s %15s %9s" % ("keyboard", "per key", "snapshot", "speedup"))
+    try:
+        pygame.display.set_mode((1, 1))
+        I = EaselLib.UserInput()
+        def perKey():
+            keys = [i for i in range(0,len(pygame.key.get_pressed())) if pygame.key.get_pressed()[i]]
+            pygame.key.set_repeat(500, 30)
+            return keys
+        queries = [pygame.K_a, pygame.K_SPACE, pygame.K_UP, pygame.K_ESCAPE, pygame.K_RETURN]
+        def new():
+            I.setKeys(pygame.key.get_pressed())
+            return [(I.isDown(k), I.wasPressed(k)) for k in queries]
+        def view():
+            I.setKeys(pygame.key.get_pressed())
+            return I.keysDown
+        G = Easel.GameAdapter(types.ModuleType("keysGame"))
+        def sent():
+            G.input.setKeys(pygame.key.get_pressed())
+            G.sendInput()
+            return [k in G.game.keysDown for k in queries]
+        assert perKey() == view()
+        sent()
+        assert G.game.keysDown == view() and sent() == [k in view() for k in queries]
+        old = timeIt(perKey, 200)
+        report("snapshot and five queries", old, timeIt(new, 2000))
+        report("snapshot and keysDown", old, timeIt(view, 2000))
+        report("sendInput and five \"in keysDown\"", old, timeIt(sent, 2000))
+    finally:
+        pygame.display.quit()
+
+# benchSchedule: writeState
+# benchSchedule() runs Easel.main on maegen (with the dummy video driver, but
+# not headless, so the loop is paced) for 60 frames at frameRate() 30 and
+# updateRate() 90, first as is and then with every tenth frame made 200 ms
+# slower, and prints the render and update rates main measured. It then
+# prints the rates of a headless run, where updates are uncapped.
+def benchSchedule():
+    import Easel
+    print("%-40s %15s %15s" % ("update schedule", "frames/s", "updates/s"))
+    (display, driven, music) = (maegen.display, maegen.eventDriven, maegen.playBackGroundMusic)
+    shown = [0]
+    def slowDisplay():
+        shown[0] += 1
+        if shown[0] % 10 == 0:
+            sleep(0.2)
+        return display()
+    try:
+        maegen.frameRate = lambda: 30
+        maegen.updateRate = lambda: 90
+        maegen.eventDriven = lambda: False
+        maegen.playBackGroundMusic = lambda name: None
+        stats = Easel.main(maegen, frames=60)
+        print("%-40s %15.1f %15.1f" % ("30 frames/s, 90 updates/s", stats["fps"], stats["ups"]))
+        maegen.display = slowDisplay
+        stats = Easel.main(maegen, frames=60)
+        print("%-40s %15.1f %15.1f" % ("with slow frames", stats["fps"], stats["ups"]))
+        maegen.display = display
+        stats = Easel.main(maegen, headless=True, frames=2000)
+        print("%-40s %15.1f %15.1f" % ("headless, uncapped", stats["fps"], stats["ups"]))
+    finally:
+        del maegen.frameRate
+        del maegen.updateRate
+        (maegen.display, maegen.eventDriven, maegen.playBackGroundMusic) = (display, driven, music)
+
+# writeTrack: string * int -> None
+# writeTrack(path,seconds) writes a stereo 44.1 kHz WAV of a tone lasting
+# seconds to path, standing in for the phase music, which isn't in media.
+def writeTrack(path, seconds):
+    import wave, array, math
+    samples = array.array("h", (int(8000 * math.sin(i / 20.0)) for i in range(44100 * seconds)))
+    w = wave.open(path, "wb")
+    w.setnchannels(2)
+    w.setsampwidth(2)
+    w.setframerate(44100)
+    for i in range(2):
+        w.writeframes(samples.tobytes())
+    w.close()
+
+# forgetPages: string -> None
+# forgetPages(path) asks the OS to drop path from its page cache, where it can,
+# so that the next read of path goes to the disk as it would at a phase change.
+def forgetPages(path):
+    if hasattr(os, "posix_fadvise"):
+        fd = os.open(path, os.O_RDONLY)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        os.close(fd)
+
+# benchMusic: writeState
+# benchMusic() writes two 10 second tracks and switches between them as a
+# game alternating phases would, 20 times, timing the call the game loop makes
+# at each switch: mixer.music.load and play, as playBackGroundMusic used to
+# do, against playBackGroundMusic handing the switch to the music worker. Each
+# switch starts from a cold page cache. It then times asking for the track
+# already playing, as a swordsman's attack phase does after its move phase.
+def benchMusic():
+    import tempfile, shutil
+    print("%-40s %15s %15s %9s" % ("music switch", "old", "new", "speedup"))
+    folder = tempfile.mkdtemp()
+    try:
+        tracks = [os.path.join(folder, n) for n in ("move.wav", "attack.wav")]
+        for t in tracks:
+            writeTrack(t, 10)
+        def switches(play):
+            times = []
+            for i in range(20):
+                forgetPages(tracks[i % 2])
+                start = perf_counter()
+                play(tracks[i % 2])
+                times.append(perf_counter() - start)
+            return times
+        EaselLib.initMixer()
+        def load(name):
+            pygame.mixer.music.load(name)
+            pygame.mixer.music.play(-1)
+        old = switches(load)
+        EaselLib.preloadMusic(tracks)
+        new = switches(EaselLib.playBackGroundMusic)
+        for i in range(200):
+            if EaselLib.musicPlaying() == tracks[1]:
+                break
+            sleep(0.01)
+        assert EaselLib.musicPlaying() == tracks[1]
+        report("mean switch", sum(old) / len(old), sum(new) / len(new))
+        report("worst switch", max(old), max(new))
+        report("same track again", timeIt(lambda: load(tracks[1]), 20),
+               timeIt(lambda: EaselLib.playBackGroundMusic(tracks[1]), 2000))
+    finally:
+        pygame.mixer.music.stop()
+        shutil.rmtree(folder)
+
+# startupScript: bool -> string
+# startupScript(eager) is a Python program that imports maegen and runs
+# Easel.main on it for one frame, printing the startup times main measured,
+# the seconds maegen took to import (game) and whether the import opened the
+# mixer (mixer), as a dict. If eager, it opens the mixer and calls
+# maegen.preload() as part of the import, as importing maegen used to do, so
+# that every asset is loaded before the window opens.
+def startupScript(eager):
+    lines = ["import EaselLib, pygame, time",
+             "start = time.perf_counter()",
+             "import maegen",
+             "if %s: EaselLib.initMixer(); maegen.preload()" % eager,
+             "game = time.perf_counter() - start",
+             "mixer = pygame.mixer.get_init() != None",
+             "import Easel, io, contextlib",
+             "with contextlib.redirect_stdout(io.StringIO()):",
+             "    stats = Easel.main(maegen, frames=1)",
+             "stats['startup'].update(game=game, mixer=mixer)",
+             "print(stats['startup'])"]
+    return "\n".join(lines)
+
+# benchStartup: writeState
+# benchStartup() starts a fresh Python process 5 times for each of eager and
+# lazy asset loading (see startupScript), and prints the median seconds that
+# importing maegen took, that its window took to show the first frame, and
+# from the import of EaselLib (which is mostly pygame's import) to the first
+# frame, and whether importing maegen opened the mixer.
+def benchStartup():
+    import subprocess, ast
+    print("%-40s %15s %15s %9s" % ("startup", "eager", "lazy", "speedup"))
+    runs = {}
+    for eager in [True, False]:
+        runs[eager] = []
+        for i in range(5):
+            out = subprocess.run([sys.executable, "-c", startupScript(eager)], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                 capture_output=True, text=True, check=True).stdout
+            runs[eager].append(ast.literal_eval(out.strip().splitlines()[-1]))
+    def median(eager, f):
+        return sorted(f(t) for t in runs[eager])[2]
+    phases = [("import maegen", lambda t: t["game"]),
+              ("window to first frame", lambda t: t["frame"] - t["window"]),
+              ("EaselLib import to first frame", lambda t: t["frame"])]
+    for (name, f) in phases:
+        old = median(True, f)
+        new = median(False, f)
+        print("%-40s %12.1f ms %12.1f ms %8.1fx" % (name, old * 1e3, new * 1e3, old / new))
+    print("%-40s %15s %15s" % ("import opens the mixer", runs[True][0]["mixer"], runs[False][0]["mixer"]))
+
+benchmarks = {
+    "aStar": benchAStar,
+    "occupancy": benchOccupancy,
+    "reach": benchReach,
+    "lineOfAttack": benchLineOfAttack,
+    "attackTargets": benchAttackTargets,
+    "largeMap": benchLargeMap,
+    "hierarchy": benchHierarchy,
+    "flowField": benchFlowField,
+    "cellDist": benchCellDist,
+    "pathCache": benchPathCache,
+    "frame": benchFrame,
+    "dirtyRects": benchDirtyRects,
+    "text": benchText,
+    "validation": benchValidation,
+    "rect": benchRect,
+    "blits": benchBlits,
+    "spriteFormat": benchSpriteFormat,
+    "displayCache": benchDisplayCache,
+    "idle": benchIdle,
+    "headless": benchHeadless,
+    "hooks": benchHooks,
+    "keys": benchKeys,
+    "schedule": benchSchedule,
+    "music": benchMusic,
+    "startup": benchStartup,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or benchmarks:
+        benchmarks[name]()